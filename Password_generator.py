@@ -1,31 +1,71 @@
-import random
+import secrets
 import string
-def pwgenerator():
-  PWUPP = random.SystemRandom().choice(string.ascii_uppercase)
-  PWLOW = random.SystemRandom().choice(string.ascii_lowercase)
-  PWLOW2 = random.SystemRandom().choice(string.ascii_lowercase)
-  PWLOW3 = random.SystemRandom().choice(string.ascii_lowercase)
-  PWDIG = random.SystemRandom().choice(string.digits)
-  PWDIG2 = random.SystemRandom().choice(string.digits)
-  PWDIG3 = random.SystemRandom().choice(string.digits)
-  PWSPEC = random.SystemRandom().choice('!@*(§')
-  PWD = None
-  PWD = random.SystemRandom().choice(random.SystemRandom().choice(string.ascii_uppercase), random.SystemRandom().choice(string.ascii_lowercase), random.SystemRandom().choice(string.digits), random.SystemRandom().choice('!@*(§'))
-  PWD = ''.join(random.sample(PWD,len(PWD)))
-  return(PWD)
 
+# Password service of nc-userimporter
+# All passwords come from one cryptographically secure source (secrets). The random bytes are
+# fetched in batches for many passwords at once, which is much faster than one call per character.
+# Every password contains at least one character of every required class (policy): passwords
+# without are discarded and replaced, so all valid passwords are equally likely.
+
+# character classes for the policy, 'special' is configurable
+passwordclasses = {
+  'upper': string.ascii_uppercase,
+  'lower': string.ascii_lowercase,
+  'digits': string.digits,
+  'special': '!@*(§',
+}
+
+class PasswordGenerator:
+  def __init__(self, length=12, classes=('upper', 'lower', 'digits', 'special'), special=None):
+    self.length = length
+    self.classes = []
+    for name in classes:
+      if name not in passwordclasses:
+        raise ValueError("unknown character class '" + name + "', use " + ", ".join(passwordclasses))
+      characters = special if name == 'special' and special else passwordclasses[name]
+      self.classes.append(frozenset(characters))
+    self.alphabet = ''.join(dict.fromkeys(''.join(''.join(sorted(characters)) for characters in self.classes)))
+    if not self.alphabet or len(self.alphabet) > 256:
+      raise ValueError("the alphabet for passwords must have 1 to 256 characters")
+    if length < len(self.classes):
+      raise ValueError("passwords with " + str(length) + " characters can't contain all " + str(len(self.classes)) + " character classes")
+    # random bytes >= limit are discarded, so every character of the alphabet is equally likely
+    self.limit = 256 - 256 % len(self.alphabet)
+
+  # count random characters of the alphabet
+  def characters(self, count):
+    alphabet = self.alphabet
+    size = len(alphabet)
+    characters = []
+    while len(characters) < count:
+      missing = count - len(characters)
+      randombytes = secrets.token_bytes(missing * 256 // self.limit + 16)
+      characters.extend(alphabet[byte % size] for byte in randombytes if byte < self.limit)
+    del characters[count:]
+    return characters
 
+  # a batch of count passwords
+  def generate(self, count):
+    passwords = []
+    while len(passwords) < count:
+      missing = count - len(passwords)
+      characters = self.characters(missing * self.length)
+      for start in range(0, len(characters), self.length):
+        password = ''.join(characters[start:start + self.length])
+        if all(not characters_of_class.isdisjoint(password) for characters_of_class in self.classes):
+          passwords.append(password)
+    return passwords
+
+  def password(self):
+    return self.generate(1)[0]
+
+# generate more dynamic Password
+# This Funktion is outdated use dynamicPW instead
+def pwgenerator():
+  return PasswordGenerator(8).password()
 
 def dynamicPW(length):
-  password = ""
-  for i in range(length):
-    rand_result = [0,0,0,0]
-    rand_result[0] = random.SystemRandom().choice(string.ascii_uppercase)
-    rand_result[1] = random.SystemRandom().choice(string.ascii_lowercase)
-    rand_result[2] = random.SystemRandom().choice(string.digits)
-    rand_result[3] = random.SystemRandom().choice('!@*(§')
-    password = password + rand_result[random.randint(0,3)]
-  return(password)
-
-
-print(dynamicPW(12))
\ No newline at end of file
+  return PasswordGenerator(length).password()
+
+if __name__ == '__main__':
+  print(dynamicPW(12))
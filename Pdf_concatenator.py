@@ -0,0 +1,93 @@
+import copy
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+# Streaming concatenation of pdf-files for nc-userimporter
+# The pages of the temporary pdf-files (chunks) are copied one file after the other into one pdf-file.
+# Every object is written to disk as soon as it has been copied, only the object offsets and the page
+# references of the whole document stay in memory. So the memory depends on the size of one chunk, not
+# on the number of pages of the document (unlike PdfWriter, which keeps all pages until it writes).
+
+class PdfConcatenator:
+  def __init__(self, path):
+    self.file = open(path, 'wb')
+    self.file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    self.offsets = [None] # file offset of every object, object 0 is not used
+    self.pagesref = self.newreference() # page tree, written by close()
+    self.rootref = self.newreference() # catalog, written by close()
+    self.pages = [] # object numbers of all pages
+    self.numbers = {} # object of the current pdf-file: its number in the document
+    self.pending = [] # objects of the current pdf-file which are referenced, but not written yet
+
+  def newreference(self):
+    self.offsets.append(None)
+    return IndirectObject(len(self.offsets) - 1, 0, None)
+
+  # reference in the document for a reference of the current pdf-file, the object is copied later
+  def reference(self, reference):
+    key = (reference.idnum, reference.generation)
+    if key not in self.numbers:
+      self.numbers[key] = self.newreference().idnum
+      self.pending.append(reference)
+    return IndirectObject(self.numbers[key], 0, None)
+
+  # copy of a value of the current pdf-file with the references of the document
+  def copy(self, value):
+    if isinstance(value, IndirectObject):
+      return self.reference(value)
+    if isinstance(value, ArrayObject):
+      return ArrayObject(self.copy(item) for item in value)
+    if isinstance(value, DictionaryObject): # also streams (the data is kept encoded) and pages
+      copied = copy.copy(value)
+      for key, item in value.items():
+        copied[key] = self.copy(item)
+      return copied
+    return value
+
+  def write(self, number, value):
+    self.offsets[number] = self.file.tell()
+    self.file.write(b'%d 0 obj\n' % number)
+    value.write_to_stream(self.file)
+    self.file.write(b'\nendobj\n')
+
+  # append all pages of a pdf-file
+  def append(self, path):
+    pages = PdfReader(path).pages
+    # references to the pages (e.g. of links) point to the copies
+    for page in pages:
+      self.numbers[(page.indirect_reference.idnum, page.indirect_reference.generation)] = self.newreference().idnum
+    for page in pages:
+      pageref = self.reference(page.indirect_reference)
+      # the page tree of the pdf-file is not copied, inherited values (resources, page size) are
+      # already set in the pages by PdfReader
+      copied = copy.copy(page)
+      for key, item in page.items():
+        copied[key] = self.pagesref if key == '/Parent' else self.copy(item)
+      self.write(pageref.idnum, copied)
+      self.pages.append(pageref.idnum)
+      while self.pending:
+        reference = self.pending.pop()
+        self.write(self.numbers[(reference.idnum, reference.generation)], self.copy(reference.get_object()))
+    self.numbers = {}
+
+  # write the page tree, the catalog and the cross-reference table
+  def close(self):
+    self.write(self.pagesref.idnum, DictionaryObject({
+      NameObject('/Type'): NameObject('/Pages'),
+      NameObject('/Kids'): ArrayObject(IndirectObject(number, 0, None) for number in self.pages),
+      NameObject('/Count'): NumberObject(len(self.pages)),
+    }))
+    self.write(self.rootref.idnum, DictionaryObject({
+      NameObject('/Type'): NameObject('/Catalog'),
+      NameObject('/Pages'): self.pagesref,
+    }))
+    xref = self.file.tell()
+    self.file.write(b'xref\n0 %d\n0000000000 65535 f \n' % len(self.offsets))
+    for offset in self.offsets[1:]:
+      self.file.write(b'%010d 00000 n \n' % offset)
+    self.file.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(self.offsets), self.rootref.idnum, xref))
+    self.file.close()
+
+  # stop without a complete document
+  def abort(self):
+    self.file.close()
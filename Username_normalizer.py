@@ -0,0 +1,150 @@
+import functools
+import collections
+import unicodedata
+
+# Normalization of user names for nc-userimporter
+# User names in Nextcloud should only contain letters a-z and A-Z, digits and a few other characters.
+# Umlauts and other special characters of the csv-file are converted into a compatible spelling:
+# first with the German transliterations of `mapping` (Müller -> Mueller), then with the Unicode
+# decomposition (Łukasz -> Lukasz, Şahin -> Sahin). The translation table is built once when the
+# module is imported, converted user names are cached.
+
+# Mapping for umlauts and and special characters. The listed umlauts and special characters are automatically converted to a compatible spelling for the user name.
+mapping = {
+           ord(u"Ä"): u"Ae",
+           ord(u"ä"): u"ae",
+           ord(u"Ë"): u"E",
+           ord(u"ë"): u"e",
+           ord(u"Ï"): u"I",
+           ord(u"ï"): u"i",
+           ord(u"Ö"): u"Oe",
+           ord(u"ö"): u"oe",           
+           ord(u"Ü"): u"Ue",
+           ord(u"ü"): u"ue",
+           ord(u"Ÿ"): u"Y",
+           ord(u"ÿ"): u"y",
+           ord(u"ß"): u"ss",
+           ord(u"À"): u"A",
+           ord(u"Á"): u"A",
+           ord(u"Â"): u"A",
+           ord(u"Ã"): u"A",
+           ord(u"Å"): u"A",
+           ord(u"Æ"): u"Ae",
+           ord(u"Ç"): u"C",
+           ord(u"È"): u"E",
+           ord(u"É"): u"E",
+           ord(u"Ê"): u"E",
+           ord(u"Ì"): u"I",
+           ord(u"Í"): u"I",
+           ord(u"Î"): u"I",
+           ord(u"Ð"): u"D",
+           ord(u"Ñ"): u"N",
+           ord(u"Ò"): u"O",
+           ord(u"Ó"): u"O",
+           ord(u"Ô"): u"O",
+           ord(u"Õ"): u"O",
+           ord(u"Ø"): u"Oe",
+           ord(u"Œ"): u"Oe",
+           ord(u"Ù"): u"U",
+           ord(u"Ú"): u"U",
+           ord(u"Û"): u"U",
+           ord(u"Ý"): u"Y",
+           ord(u"Þ"): u"Th",
+           ord(u"à"): u"a",
+           ord(u"á"): u"a",
+           ord(u"â"): u"a",
+           ord(u"ã"): u"a",
+           ord(u"å"): u"a",
+           ord(u"æ"): u"ae",
+           ord(u"ç"): u"c",
+           ord(u"è"): u"e",
+           ord(u"é"): u"e",
+           ord(u"ê"): u"e",
+           ord(u"ì"): u"i",
+           ord(u"í"): u"i",
+           ord(u"î"): u"i",
+           ord(u"ð"): u"d",
+           ord(u"ñ"): u"n",
+           ord(u"ò"): u"o",
+           ord(u"ó"): u"o",
+           ord(u"ô"): u"o",
+           ord(u"õ"): u"o",
+           ord(u"ø"): u"oe",
+           ord(u"œ"): u"oe",
+           ord(u"ù"): u"u",
+           ord(u"ú"): u"u",
+           ord(u"û"): u"u",
+           ord(u"ý"): u"y",
+           ord(u"þ"): u"Th",
+           ord(u"Š"): u"S",
+           ord(u"š"): u"s",
+           ord(u"Č"): u"C",
+           ord(u"č"): u"c"
+           }
+
+# letters without a decomposition into a basic letter and an accent
+extramapping = {
+           ord(u"Ł"): u"L",
+           ord(u"ł"): u"l",
+           ord(u"Đ"): u"D",
+           ord(u"đ"): u"d",
+           ord(u"Ħ"): u"H",
+           ord(u"ħ"): u"h",
+           ord(u"ı"): u"i",
+           ord(u"Ŀ"): u"L",
+           ord(u"ŀ"): u"l",
+           ord(u"Ŋ"): u"N",
+           ord(u"ŋ"): u"n",
+           ord(u"Ŧ"): u"T",
+           ord(u"ŧ"): u"t",
+           ord(u"ſ"): u"s",
+           ord(u"Ɨ"): u"I",
+           ord(u"ƚ"): u"l",
+           ord(u"ẞ"): u"SS",
+           }
+
+# Function: build the translation table for all latin letters (Latin-1 Supplement, Latin Extended-A/B
+# and Latin Extended Additional)
+def buildtable():
+  table = {}
+  for codepoint in list(range(0x00C0, 0x0250)) + list(range(0x1E00, 0x1F00)):
+    decomposed = unicodedata.normalize('NFKD', chr(codepoint))
+    basic = ''.join(character for character in decomposed if not unicodedata.combining(character))
+    if basic != chr(codepoint) and basic.isascii() and basic.isalpha():
+      table[codepoint] = basic
+  table.update(extramapping)
+  table.update(mapping) # the German spelling has priority, e.g. ü -> ue instead of u
+  return table
+
+table = buildtable()
+
+# Function: the compatible spelling of a user name
+# Decomposed input (e.g. csv-files from a Mac: u + combining diaeresis) is composed first, so it gets the
+# same spelling as precomposed input. Combining marks without a precomposed letter are dropped.
+@functools.lru_cache(maxsize=65536)
+def normalize(userid):
+  userid = unicodedata.normalize('NFC', userid).translate(table)
+  return ''.join(character for character in userid if not unicodedata.combining(character))
+
+# Collision of a user name: the row of the csv-file, its user name in the csv-file, the converted user
+# name and the earlier row with the same converted user name (None: the user exists in the cloud)
+Collision = collections.namedtuple('Collision', ['row', 'original', 'userid', 'other'])
+
+# Function: find user names which are not unique after the conversion
+# users: (row, user name in the csv-file, converted user name) of all rows, existing: user names in the
+# cloud. User names are compared case-insensitive like in Nextcloud, with one index over all rows.
+# A row collides with a user in the cloud only if the names match after the conversion alone (the
+# csv-file says Müller, the cloud has Mueller): a user with exactly the same name is the same user.
+def findcollisions(users, existing=()):
+  existing = {userid.lower() for userid in existing}
+  index = {}
+  collisions = []
+  for row, original, userid in users:
+    key = userid.lower()
+    if key in index:
+      collisions.append(Collision(row, original, userid, index[key]))
+      continue
+    index[key] = row
+    if key in existing and original.lower() != key:
+      collisions.append(Collision(row, original, userid, None))
+  return collisions
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from tabulate import tabulate
+from mockocs import MockCloud, startserver
+
+# Benchmark of nc-userimporter without a real Nextcloud
+# Generates csv-files with synthetic users (school with teachers, students, classes and courses),
+# starts the local mock cloud (mockocs.py) and runs the importer in batch mode against it.
+# Reports the throughput, the peak memory and the timings of all phases of every import, so
+# performance regressions are visible before a new version is rolled out.
+#
+# Example: python3 benchmark/benchmark.py --rows 100 1000 10000 --latency 0.02 --throttle 0.01
+
+# Copyright (C) 2019-2020 Torsten Markmann
+# Mail: info@uplinked.net
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+appdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # directory of nc-userimporter.py
+
+parser = argparse.ArgumentParser(description="Benchmark of nc-userimporter with a local mock cloud.")
+parser.add_argument('--rows', type=int, nargs='+', default=[100, 1000], help="users per csv-file, one import per value (e.g. 100 1000 50000)")
+parser.add_argument('--latency', type=float, default=0.02, help="seconds per request of the mock cloud (default: 0.02)")
+parser.add_argument('--errors', type=float, default=0.0, help="share of requests which fail with 500 (e.g. 0.01)")
+parser.add_argument('--throttle', type=float, default=0.0, help="share of requests which are throttled with 429 (e.g. 0.05)")
+parser.add_argument('--retry-after', type=int, default=1, help="seconds in the Retry-After header of a 429 (default: 1)")
+parser.add_argument('--concurrency', type=int, help="concurrency of the importer (default: from config.xml)")
+parser.add_argument('--pdfworkers', type=int, help="render processes of the importer (default: from config.xml)")
+parser.add_argument('--onedoc', action='store_true', help="render one pdf-file with all users (pdfonedoc = yes)")
+parser.add_argument('--seed', type=int, default=1, help="seed for the synthetic users (default: 1)")
+parser.add_argument('--json', help="write the results as json into this file")
+parser.add_argument('--keep', action='store_true', help="keep the csv-files, pdf-files and logs of the imports")
+parser.add_argument('--verbose', action='store_true', help="show the console output of the importer")
+
+firstnames = ['Anna', 'Ben', 'Clara', 'Deniz', 'Emil', 'Fatma', 'Jörg', 'Lena', 'Lukas', 'Mia', 'Noah', 'Özlem',
+  'Paul', 'Sophie', 'Zoë', 'Jürgen', 'Ümit', 'Hannah', 'Élodie', 'Björn']
+lastnames = ['Müller', 'Schmidt', 'Schneider', 'Fischer', 'Weiß', 'Becker', 'Schäfer', 'Koch', 'Yılmaz',
+  'Groß', 'Öztürk', 'Hoffmann', 'Lefèvre', 'Wagner', 'Nowak']
+subjects = ['Mathe', 'Deutsch', 'Englisch', 'Physik', 'Chemie', 'Biologie', 'Geschichte', 'Kunst', 'Musik', 'Sport']
+
+# name of the class with the index i: jg05a ... jg13f, then jg05a2 ...
+def classname(i):
+  return 'jg%02d%s%s' % (5 + (i // 6) % 9, 'abcdef'[i % 6], str(i // 54 + 1) if i >= 54 else '')
+
+# Function: write a csv-file with `rows` synthetic users
+# 10 % teachers (group Lehrkraefte, 2-4 classes, group admin of one class), 90 % students (group
+# SchuelerInnen, one class of about 25 students, 0-2 courses). Most users get a generated password.
+def generatecsv(path, rows, seed, delimiter, groupdelimiter):
+  rng = random.Random(seed)
+  classes = max(1, rows * 9 // 10 // 25)
+  courses = max(1, rows // 60)
+  with open(path, 'w', encoding='utf-8', newline='') as csvfile:
+    writer = csv.writer(csvfile, delimiter=delimiter)
+    writer.writerow(['username', 'displayname', 'password', 'email', 'groups', 'subadmin', 'quota'])
+    for number in range(rows):
+      first, last = rng.choice(firstnames), rng.choice(lastnames)
+      userid = (first + '.' + last).lower() + str(number)
+      password = '' if rng.random() < 0.8 else ''.join(rng.choice('abcdefghkmnpqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789') for i in range(12)) + '!'
+      email = '' if rng.random() < 0.5 else userid + '@schule.example.org'
+      if number % 10 == 0:
+        groups = ['Lehrkraefte'] + [classname(rng.randrange(classes)) for i in range(rng.randint(2, 4))]
+        subadmin = [groups[1]]
+        quota = '5 GB'
+      else:
+        groups = ['SchuelerInnen', classname(number % classes)] + ['kurs_' + rng.choice(subjects) + '_' + str(rng.randrange(courses)) for i in range(rng.randint(0, 2))]
+        subadmin = []
+        quota = '1 GB'
+      writer.writerow([userid, first + ' ' + last, password, email, groupdelimiter.join(dict.fromkeys(groups)), groupdelimiter.join(subadmin), quota])
+
+# replace the value of a setting in the text of config.xml (the setting is added if it is missing)
+def setconfig(config, name, value):
+  if re.search('<' + name + '>.*?</' + name + '>', config):
+    return re.sub('<' + name + '>.*?</' + name + '>', lambda match: '<' + name + '>' + value + '</' + name + '>', config)
+  return config.replace('</config>', '<' + name + '>' + value + '</' + name + '>\n</config>')
+
+def configvalue(config, name, default):
+  match = re.search('<' + name + '>(.*?)</' + name + '>', config)
+  return match.group(1).strip() if match else default
+
+# Function: one import of `rows` users against a new mock cloud
+# Returns the results: seconds, throughput, peak memory, counts of the mock cloud and the summary of the importer.
+def benchmark(rows, args, workdir):
+  with open(os.path.join(appdir, 'config.xml'), encoding='utf-8') as configfile:
+    config = configfile.read()
+  delimiter = configvalue(config, 'csvdelimiter', ';')
+  groupdelimiter = configvalue(config, 'csvdelimitergroups', ',')
+  csvpath = os.path.join(workdir, 'users_' + str(rows) + '.csv')
+  generatecsv(csvpath, rows, args.seed, delimiter, groupdelimiter)
+
+  cloud = MockCloud(args.latency, args.errors, args.throttle, args.retry_after)
+  server = startserver(cloud)
+  settings = {
+    'cloudurl': 'http://127.0.0.1:' + str(server.server_address[1]),
+    'adminname': 'admin',
+    'adminpass': 'benchmark',
+    'generatepassword': 'yes',
+    'existingusers': 'skip',
+    'previewrows': '10',
+    'pdfonedoc': 'yes' if args.onedoc else 'no',
+  }
+  if args.concurrency:
+    settings['concurrency'] = str(args.concurrency)
+  if args.pdfworkers is not None:
+    settings['pdfworkers'] = str(args.pdfworkers)
+  for name, value in settings.items():
+    config = setconfig(config, name, value)
+  configpath = os.path.join(workdir, 'config_' + str(rows) + '.xml')
+  with open(configpath, 'w', encoding='utf-8') as configfile:
+    configfile.write(config)
+
+  summarypath = os.path.join(workdir, 'summary_' + str(rows) + '.json')
+  command = [sys.executable, os.path.join(appdir, 'nc-userimporter.py'), '--yes', '--config', configpath, '--csv', csvpath,
+    '--output-dir', os.path.join(workdir, 'output_' + str(rows)), '--summary', summarypath]
+  output = None if args.verbose else subprocess.DEVNULL
+  started = time.perf_counter()
+  process = subprocess.Popen(command, cwd=workdir, stdin=subprocess.DEVNULL, stdout=output, stderr=output)
+  # peak memory of the importer (the largest of its processes), only available on Linux and Mac
+  if hasattr(os, 'wait4'):
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    peakmb = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+  else:
+    process.wait()
+    peakmb = None
+  seconds = time.perf_counter() - started
+  server.shutdown()
+  server.server_close()
+
+  summary = {}
+  if os.path.isfile(summarypath):
+    with open(summarypath, encoding='utf-8') as summaryfile:
+      summary = json.load(summaryfile)
+  return {
+    'rows': rows,
+    'exitcode': process.returncode,
+    'seconds': round(seconds, 3),
+    'rows_per_s': round(rows / seconds, 1),
+    'peak_mb': round(peakmb, 1) if peakmb is not None else None,
+    'requests': cloud.counts['requests'],
+    'throttled': cloud.counts['throttled'],
+    'errors': cloud.counts['errors'],
+    'retries': summary.get('retries'),
+    'results': summary.get('results', {}),
+    'timings': summary.get('timings', []),
+  }
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  workdir = tempfile.mkdtemp(prefix='nc-userimporter-benchmark_')
+  results = []
+  try:
+    for rows in args.rows:
+      print("Import of " + str(rows) + " users...")
+      results.append(benchmark(rows, args, workdir))
+  finally:
+    if args.keep:
+      print("The files of the imports are in " + workdir)
+    else:
+      shutil.rmtree(workdir, ignore_errors=True)
+
+  print("")
+  print("Mock cloud: latency " + str(args.latency) + " s, errors " + str(args.errors) + ", throttled " + str(args.throttle))
+  columns = ['rows', 'exitcode', 'seconds', 'rows_per_s', 'peak_mb', 'requests', 'throttled', 'errors', 'retries']
+  print(tabulate([[result[column] for column in columns] for result in results], headers=columns))
+  for result in results:
+    print("")
+    print("Timings of the import of " + str(result['rows']) + " users:")
+    print(tabulate(result['timings'], headers="keys"))
+
+  if args.json:
+    with open(args.json, 'w', encoding='utf-8') as jsonfile:
+      json.dump({'settings': vars(args), 'results': results}, jsonfile, indent=2)
+
+  # a failed import (e.g. too many errors for the retries) is a failed benchmark
+  sys.exit(0 if all(result['exitcode'] in (0, 3) for result in results) else 1)
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+import sys
+import time
+import json
+import random
+import argparse
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the OCS API of a Nextcloud, for the benchmark of nc-userimporter.
+# Implements the parts of /cloud/users and /cloud/groups which the importer uses, with configurable
+# latency, server errors (5xx) and throttling (429 with Retry-After). Answers in json (format=json)
+# or xml like a real cloud. Nothing is stored on disk.
+
+# Copyright (C) 2019-2020 Torsten Markmann
+# Mail: info@uplinked.net
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# state of the cloud and the settings of the server
+class MockCloud:
+  def __init__(self, latency=0.0, errors=0.0, throttle=0.0, retryafter=1):
+    self.latency = latency # seconds per request
+    self.errors = errors # share of requests which fail with 500
+    self.throttle = throttle # share of requests which are throttled with 429
+    self.retryafter = retryafter # seconds in the Retry-After header of a 429
+    self.users = {'admin': {'groups': ['admin'], 'subadmin': [], 'enabled': True}}
+    self.groups = {'admin'}
+    self.lock = threading.Lock()
+    self.counts = {'requests': 0, 'errors': 0, 'throttled': 0}
+
+  def count(self, name):
+    with self.lock:
+      self.counts[name] += 1
+
+  # answer of a request: (statuscode, message, data)
+  def route(self, method, parts, query, form):
+    if parts == ['cloud', 'users'] and method == 'GET':
+      return 100, 'OK', {'users': self.page(sorted(self.users), query)}
+    if parts == ['cloud', 'users'] and method == 'POST':
+      userid = form.get('userid', [''])[0]
+      if not userid:
+        return 101, 'no userid given', []
+      if userid.lower() in (existing.lower() for existing in self.users):
+        return 102, 'User already exists', []
+      for group in form.get('groups[]', []) + form.get('subadmin[]', []):
+        if group not in self.groups:
+          return 104, 'group ' + group + ' does not exist', []
+      self.users[userid] = {'groups': form.get('groups[]', []), 'subadmin': form.get('subadmin[]', []), 'enabled': True}
+      return 100, 'OK', {'id': userid}
+    if parts == ['cloud', 'groups'] and method == 'GET':
+      return 100, 'OK', {'groups': self.page(sorted(self.groups), query)}
+    if parts == ['cloud', 'groups'] and method == 'POST':
+      group = form.get('groupid', [''])[0]
+      if group in self.groups:
+        return 102, 'group exists', []
+      self.groups.add(group)
+      return 100, 'OK', []
+    if len(parts) >= 3 and parts[:2] == ['cloud', 'users']:
+      user = self.users.get(parts[2])
+      if user is None:
+        return 101, 'user does not exist', []
+      if len(parts) == 3 and method == 'GET':
+        return 100, 'OK', {'id': parts[2], 'groups': user['groups'], 'enabled': user['enabled']}
+      if len(parts) == 3 and method == 'PUT':
+        user[form.get('key', [''])[0]] = form.get('value', [''])[0]
+        return 100, 'OK', []
+      if len(parts) == 3 and method == 'DELETE':
+        del self.users[parts[2]]
+        return 100, 'OK', []
+      if len(parts) == 4 and parts[3] in ('enable', 'disable') and method == 'PUT':
+        user['enabled'] = parts[3] == 'enable'
+        return 100, 'OK', []
+      if len(parts) == 4 and parts[3] in ('groups', 'subadmins'):
+        group = form.get('groupid', [''])[0]
+        if group not in self.groups:
+          return 102, 'group does not exist', []
+        key = 'groups' if parts[3] == 'groups' else 'subadmin'
+        if method == 'POST' and group not in user[key]:
+          user[key].append(group)
+        elif method == 'DELETE' and group in user[key]:
+          user[key].remove(group)
+        return 100, 'OK', []
+    return 998, 'not found', []
+
+  # limit/offset of a list request
+  def page(self, entries, query):
+    search = query.get('search', [''])[0]
+    if search:
+      entries = [entry for entry in entries if search.lower() in entry.lower()]
+    offset = int(query.get('offset', ['0'])[0])
+    if 'limit' in query:
+      return entries[offset:offset + int(query['limit'][0])]
+    return entries[offset:]
+
+# one OCS answer as xml, like a real cloud without format=json
+def xmlanswer(status, statuscode, message, data):
+  def element(value):
+    if isinstance(value, dict):
+      return ''.join('<%s>%s</%s>' % (key, element(item), key) for key, item in value.items())
+    if isinstance(value, list):
+      return ''.join('<element>%s</element>' % element(item) for item in value)
+    return html_escape(str(value))
+  return ('<?xml version="1.0"?>\n<ocs><meta><status>%s</status><statuscode>%d</statuscode><message>%s</message></meta><data>%s</data></ocs>'
+    % (status, statuscode, html_escape(message), element(data)))
+
+def html_escape(value):
+  return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+class MockHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1' # keep-alive like a real cloud
+  # headers and body are separate writes: without this, Nagle and the delayed ACK of the client add
+  # about 40 ms to every keep-alive request, which would swamp the configured latency
+  disable_nagle_algorithm = True
+  cloud = None
+
+  def log_message(self, *args):
+    pass
+
+  def send(self, code, body, contenttype, headers=()):
+    body = body.encode('utf-8')
+    self.send_response(code)
+    self.send_header('Content-Type', contenttype)
+    self.send_header('Content-Length', str(len(body)))
+    for name, value in headers:
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def answer(self, method):
+    cloud = self.cloud
+    url = urllib.parse.urlsplit(self.path)
+    query = urllib.parse.parse_qs(url.query)
+    length = int(self.headers.get('Content-Length') or 0)
+    form = urllib.parse.parse_qs(self.rfile.read(length).decode('utf-8'), keep_blank_values=True) if length else {}
+    cloud.count('requests')
+    if cloud.latency:
+      time.sleep(cloud.latency)
+    if cloud.throttle and random.random() < cloud.throttle:
+      cloud.count('throttled')
+      return self.send(429, 'Too Many Requests', 'text/plain', [('Retry-After', str(cloud.retryafter))])
+    if cloud.errors and random.random() < cloud.errors:
+      cloud.count('errors')
+      return self.send(500, 'Internal Server Error', 'text/plain')
+    if not self.headers.get('Authorization') or self.headers.get('OCS-APIRequest') != 'true':
+      return self.send(401, 'Unauthorized', 'text/plain')
+    path = url.path.split('/ocs/v1.php/', 1)[-1]
+    parts = [urllib.parse.unquote(part) for part in path.strip('/').split('/')]
+    with cloud.lock:
+      statuscode, message, data = cloud.route(method, parts, query, form)
+    status = 'ok' if statuscode == 100 else 'failure'
+    if query.get('format', ['xml'])[0] == 'json':
+      self.send(200, json.dumps({'ocs': {'meta': {'status': status, 'statuscode': statuscode, 'message': message}, 'data': data}}), 'application/json')
+    else:
+      self.send(200, xmlanswer(status, statuscode, message, data), 'text/xml')
+
+  def do_GET(self):
+    self.answer('GET')
+
+  def do_POST(self):
+    self.answer('POST')
+
+  def do_PUT(self):
+    self.answer('PUT')
+
+  def do_DELETE(self):
+    self.answer('DELETE')
+
+# start the server in a thread, returns the server (server.server_address, server.shutdown())
+def startserver(cloud, port=0):
+  handler = type('MockHandler', (MockHandler,), {'cloud': cloud})
+  server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+  server.daemon_threads = True
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  return server
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Local mock of the Nextcloud OCS API for nc-userimporter.")
+  parser.add_argument('--port', type=int, default=8080)
+  parser.add_argument('--latency', type=float, default=0.0, help="seconds per request")
+  parser.add_argument('--errors', type=float, default=0.0, help="share of requests which fail with 500, e.g. 0.01")
+  parser.add_argument('--throttle', type=float, default=0.0, help="share of requests which are throttled with 429, e.g. 0.05")
+  parser.add_argument('--retry-after', type=int, default=1, help="seconds in the Retry-After header of a 429")
+  args = parser.parse_args()
+  server = startserver(MockCloud(args.latency, args.errors, args.throttle, args.retry_after), args.port)
+  print("Mock cloud running on http://127.0.0.1:" + str(args.port) + " - press [CONTROL + C] to stop.")
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    server.shutdown()
+    sys.exit(0)
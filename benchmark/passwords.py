@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import random
+import string
+import argparse
+from tabulate import tabulate
+
+# Benchmark of the password generation: the old dynamicPW (one SystemRandom per character class and
+# character) against the batches of PasswordGenerator (Password_generator.py).
+#
+# Example: python3 benchmark/passwords.py --count 100000
+
+# Copyright (C) 2019-2020 Torsten Markmann
+# Mail: info@uplinked.net
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Password_generator import PasswordGenerator
+
+parser = argparse.ArgumentParser(description="Benchmark of the password generation of nc-userimporter.")
+parser.add_argument('--count', type=int, default=100000, help="number of passwords (default: 100000)")
+parser.add_argument('--length', type=int, default=12, help="characters per password (default: 12)")
+
+# dynamicPW up to version 1.x, for comparison
+def olddynamicPW(length):
+  password = ""
+  for i in range(length):
+    rand_result = [0,0,0,0]
+    rand_result[0] = random.SystemRandom().choice(string.ascii_uppercase)
+    rand_result[1] = random.SystemRandom().choice(string.ascii_lowercase)
+    rand_result[2] = random.SystemRandom().choice(string.digits)
+    rand_result[3] = random.SystemRandom().choice('!@*(§')
+    password = password + rand_result[random.randint(0,3)]
+  return(password)
+
+def measure(name, generate, count):
+  started = time.perf_counter()
+  passwords = generate()
+  seconds = time.perf_counter() - started
+  return [name, count, round(seconds, 3), round(count / seconds), len(set(passwords))]
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  generator = PasswordGenerator(args.length)
+  results = [
+    measure("dynamicPW (old, one password per call)", lambda: [olddynamicPW(args.length) for i in range(args.count)], args.count),
+    measure("PasswordGenerator.password (one per call)", lambda: [generator.password() for i in range(args.count)], args.count),
+    measure("PasswordGenerator.generate (one batch)", lambda: generator.generate(args.count), args.count),
+  ]
+  print(tabulate(results, headers=["method", "passwords", "seconds", "passwords/s", "unique"]))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import importlib.util
+from pypdf import PdfReader
+from tabulate import tabulate
+
+# Regression check of the pdf-files of nc-userimporter
+# Renders the letters of synthetic users with renderpdf of the importer (one pdf-file per user and one
+# chunk with all users like pdfonedoc) and checks that every pdf-file has exactly one page per user and
+# that the time per user does not grow with the number of users already rendered (a story which keeps
+# the flowables of earlier users would make every pdf-file longer and slower). Exit code 1 on failure.
+#
+# Example: python3 benchmark/pdfpages.py --users 1000
+
+# Copyright (C) 2019-2020 Torsten Markmann
+# Mail: info@uplinked.net
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+appdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # directory of nc-userimporter.py
+sys.path.insert(0, appdir) # modules of the importer
+
+parser = argparse.ArgumentParser(description="Regression check of the pdf-files of nc-userimporter.")
+parser.add_argument('--users', type=int, default=1000, help="synthetic users (default: 1000)")
+parser.add_argument('--growth', type=float, default=1.5, help="allowed ratio of the time per user of the last tenth to the first tenth (default: 1.5)")
+
+# the importer as a module (the file name is not a valid module name), main() is not run
+def loadimporter():
+  spec = importlib.util.spec_from_file_location('ncuserimporter', os.path.join(appdir, 'nc-userimporter.py'))
+  importer = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(importer)
+  importer.config_protocol = 'https'
+  importer.config_ncUrl = 'cloud.example.org'
+  importer.config_letterTemplate = 'letter.xml'
+  importer.loadletter()
+  return importer
+
+def syntheticuser(importer, number):
+  return importer.User(number=number, userid='user' + str(number), displayname='User ' + str(number), password='Pa55word!' + str(number),
+    email='', groups=('SchuelerInnen',), subadmin=(), quota='1 GB', generated=True, csvuserid='user' + str(number))
+
+def pages(path):
+  return len(PdfReader(path).pages)
+
+if __name__ == '__main__':
+  args = parser.parse_args()
+  importer = loadimporter()
+  users = [syntheticuser(importer, number) for number in range(1, args.users + 1)]
+  workdir = tempfile.mkdtemp(prefix='nc-userimporter-pdfpages_')
+  errors = []
+  try:
+    # one pdf-file per user
+    seconds = []
+    for user in users:
+      path = os.path.join(workdir, user.userid + '.pdf')
+      started = time.perf_counter()
+      importer.renderpdf(path, [user], 52)
+      seconds.append(time.perf_counter() - started)
+      if pages(path) != 1:
+        errors.append("ERROR: the pdf-file of " + user.userid + " has " + str(pages(path)) + " pages")
+      os.remove(path)
+    tenth = max(1, len(seconds) // 10)
+    first = sum(seconds[:tenth]) / tenth
+    last = sum(seconds[-tenth:]) / tenth
+    if last > first * args.growth:
+      errors.append("ERROR: the time per user grows from " + str(round(first * 1000, 1)) + " ms to " + str(round(last * 1000, 1)) + " ms")
+
+    # one chunk with all users (pdfonedoc)
+    path = os.path.join(workdir, 'chunk.pdf')
+    started = time.perf_counter()
+    importer.renderpdf(path, users, 72)
+    chunkseconds = time.perf_counter() - started
+    if pages(path) != len(users):
+      errors.append("ERROR: the chunk with " + str(len(users)) + " users has " + str(pages(path)) + " pages")
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+
+  print(tabulate([
+    ["one pdf-file per user", len(users), round(sum(seconds), 3), round(first * 1000, 1), round(last * 1000, 1)],
+    ["one chunk with all users", len(users), round(chunkseconds, 3), None, None],
+  ], headers=["pdf-files", "users", "seconds", "ms/user first tenth", "ms/user last tenth"]))
+  for line in errors:
+    print(line)
+  sys.exit(1 if errors else 0)
@@ -6,19 +6,42 @@ import time
 import requests
 import certifi
 import csv
-import string
 import urllib.parse
-import qrcode
+import urllib3
 import random
 import codecs
 import html
+import email.utils
+import collections
+import copy
+import functools
+import contextlib
+import math
+import io
+import json
+import hashlib
+import argparse
+import xml.etree.ElementTree as ElementTree
+import threading
+import queue
+import logging
+import logging.handlers
+import re
+import shutil
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
 from reportlab.lib.enums import TA_JUSTIFY
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.graphics.barcode.qr import QrCodeWidget
+from reportlab.graphics.shapes import Drawing
 from tabulate import tabulate
 from bs4 import BeautifulSoup
-from datetime import datetime
+from Pdf_concatenator import PdfConcatenator
+from datetime import datetime, timezone
+from Password_generator import PasswordGenerator
+from Username_normalizer import normalize, findcollisions
 
 # This tool creates Nextcloud users from a CSV file, which you exported from some other software.
 # and security-related peculiarities when importing users in the school sector.
@@ -40,19 +63,6 @@ from datetime import datetime
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-print("")
-print("")
-print("###################################################################################")
-print("# NEXTCLOUD-USER-IMPORTER                                                         #")
-print("###################################################################################")
-print("")
-print("Copyright (C) 2019-2020 Torsten Markmann (t-markmann),")
-print("Contributors: Johannes Schirge (Shen), Nicolas Stuhlfauth (nicostuhlfauth), Daniel Bruns")
-print("This program comes with ABSOLUTELY NO WARRANTY")
-print("This is free software, and you are welcome to redistribute it under certain conditions.")
-print("For details look into LICENSE file (GNU GPLv3).")
-print("")
-
 # Useful resources for contributors:
 # Nextcloud user API https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_users.html
 # Nextcloud group API https://docs.nextcloud.com/server/latest/admin_manual/configuration_user/instruction_set_for_groups.html
@@ -69,51 +79,94 @@ else:
   appdir = os.path.dirname(os.path.abspath(__file__))
   ## print("Executable is run in normal Python environment, appdir set to: " + appdir) # for debug
 
-# read config from xml file
-configfile = codecs.open(os.path.join(appdir,'config.xml'),mode='r', encoding='utf-8')
-config = configfile.read()
-configfile.close()
-
-# load config values into variables
-config_xmlsoup = BeautifulSoup(config, "html.parser") # parse
-config_ncUrl = config_xmlsoup.find('cloudurl').string
-config_adminname = config_xmlsoup.find('adminname').string
-config_adminpass = urllib.parse.quote(config_xmlsoup.find('adminpass').string)
-config_csvfile = config_xmlsoup.find('csvfile').string
-config_csvDelimiter = config_xmlsoup.find('csvdelimiter').string
-config_csvDelimiterGroups = config_xmlsoup.find('csvdelimitergroups').string
-config_GeneratePassword = config_xmlsoup.find('generatepassword').string
-config_sslVerify = eval(config_xmlsoup.find('sslverify').string)
-config_language = config_xmlsoup.find('language').string
-config_pdfOneDoc = config_xmlsoup.find('pdfonedoc').string
-config_schoolgroup = config_xmlsoup.find('schoolgroup').string
-
-print("")
-print("###################################################################################")
-print("# Welcome to the Nextcloud user import.                                           #")
-print("# Please check the preview of the user import very carefully before you start     #")
-print("# the import process.                                                             #")
-print("###################################################################################")
-print("")
-print("")
-print("When you are sure that your settings in the config.xml are correct,")
-print("press [ANY KEY] to continue.")
-input("Otherwise, press [CONTROL + C] to abort the process.")
-print("")
-print("They have decided to continue. A user import preview is generated.")
-print("")    
-
-# check if user-import-csv-filme exists
-if not os.path.isfile(config_csvfile):
-    
-    print("ERROR!")
-    print("The csv-file (" + config_csvfile + ") you specified in you config.xml does not exist. Please save '" + config_csvfile + "' in main-directory of the script or edit your config.xml")
-    input("Press [ANY KEY] to confirm and end the process.")     
-    sys.exit(1)
-
-# cut http and https from ncUrl, because people often just copy & paste including protocol
-config_ncUrl = config_ncUrl.replace("http://", "")
-config_ncUrl = config_ncUrl.replace("https://", "")
+# command line options
+parser = argparse.ArgumentParser(description="Creates Nextcloud users from a CSV file.",
+  epilog="Exit codes: 0 = import finished, 1 = error (config, csv-file, cloud not reachable, pdf-files), "
+  "3 = import finished, but some users could not be created, 130 = aborted with [CONTROL + C]")
+parser.add_argument('--resume', action='store_true', help="continue the last import of the csv-file where it stopped")
+parser.add_argument('--config', default=os.path.join(appdir, 'config.xml'), help="path of the config file (default: config.xml in the script-directory)")
+parser.add_argument('--csv', help="path of the csv-file, instead of csvfile in the config file")
+parser.add_argument('--yes', action='store_true', help="don't ask for confirmations, for unattended runs (e.g. with cron)")
+parser.add_argument('--dry-run', action='store_true', help="only show the preview of the import, nothing is changed in the cloud")
+parser.add_argument('--concurrency', type=int, help="requests at the same time, instead of concurrency in the config file")
+parser.add_argument('--output-dir', default='output', help="folder for the pdf-files, output.log and the journal (default: output)")
+parser.add_argument('--summary', help="write a summary of the import as json into this file ('-' for the console)")
+parser.add_argument('--sync', action='store_true', help="only send the changes since the last import of the csv-file, remove users which are no longer in it (see removedusers)")
+parser.add_argument('--snapshot', help="path of the snapshot of the last import (default: in the output-directory)")
+args = None # set by main()
+
+# wait for [ANY KEY], but not in batch mode (--yes)
+def pause(text):
+  if not args.yes:
+    input(text)
+
+# Function: read config from xml file and load config values into variables
+# Options of the command line overrule the config file.
+
+def loadconfig(path):
+  global config_xmlsoup, config_ncUrl, config_adminname, config_adminpass, config_csvfile, config_csvDelimiter
+  global config_csvDelimiterGroups, config_GeneratePassword, config_sslVerify, config_language, config_pdfOneDoc
+  global config_schoolgroup, config_concurrency, config_poolsize, config_timeout, config_retries, config_backoff
+  global config_rateLimit, config_existingUsers, config_pdfWorkers, config_pdfChunkSize, config_letterTemplate
+  global config_previewRows, config_logFlush, config_protocol, config_passwordLength, config_passwordClasses
+  global config_passwordSpecial, config_removedUsers, config_removeLimit
+
+  if not os.path.isfile(path):
+    raise FatalError("ERROR!", "The config file (" + path + ") does not exist.")
+  configfile = codecs.open(path,mode='r', encoding='utf-8')
+  config = configfile.read()
+  configfile.close()
+
+  config_xmlsoup = BeautifulSoup(config, "html.parser") # parse
+
+  config_ncUrl = config_xmlsoup.find('cloudurl').string
+  config_adminname = config_xmlsoup.find('adminname').string
+  config_adminpass = config_xmlsoup.find('adminpass').string
+  config_csvfile = config_xmlsoup.find('csvfile').string
+  config_csvDelimiter = config_xmlsoup.find('csvdelimiter').string
+  config_csvDelimiterGroups = config_xmlsoup.find('csvdelimitergroups').string
+  config_GeneratePassword = config_xmlsoup.find('generatepassword').string
+  config_sslVerify = eval(config_xmlsoup.find('sslverify').string)
+  config_language = config_xmlsoup.find('language').string
+  config_pdfOneDoc = config_xmlsoup.find('pdfonedoc').string
+  config_schoolgroup = config_xmlsoup.find('schoolgroup').string
+  config_concurrency = max(1, int(configvalue('concurrency', '1')))
+  config_poolsize = max(config_concurrency, int(configvalue('poolsize', '10')))
+  config_timeout = float(configvalue('timeout', '60'))
+  config_retries = int(configvalue('retries', '3'))
+  config_backoff = float(configvalue('backoff', '0.5'))
+  config_rateLimit = float(configvalue('ratelimit', '0'))
+  config_existingUsers = configvalue('existingusers', 'skip')
+  config_pdfWorkers = max(0, int(configvalue('pdfworkers', '2')))
+  config_pdfChunkSize = max(1, int(configvalue('pdfchunksize', '100')))
+  config_letterTemplate = configvalue('lettertemplate', 'letter.xml')
+  config_previewRows = max(0, int(configvalue('previewrows', '100')))
+  config_logFlush = float(configvalue('logflush', '5'))
+  config_passwordLength = int(configvalue('passwordlength', '12'))
+  config_passwordClasses = [name.strip() for name in configvalue('passwordclasses', 'upper,lower,digits,special').split(',') if name.strip()]
+  config_passwordSpecial = configvalue('passwordspecial', '!@*(§')
+  config_removedUsers = configvalue('removedusers', 'disable')
+  config_removeLimit = float(configvalue('removelimit', '25'))
+
+  if args.csv:
+    config_csvfile = os.path.abspath(args.csv)
+  if args.concurrency:
+    config_concurrency = max(1, args.concurrency)
+    config_poolsize = max(config_concurrency, config_poolsize)
+
+  # cut http and https from ncUrl, because people often just copy & paste including protocol
+  # Only a cloud on this computer (e.g. the mock server of the benchmark) is used without https.
+  if config_ncUrl.startswith("http://") and urllib.parse.urlsplit(config_ncUrl).hostname in ('localhost', '127.0.0.1'):
+    config_protocol = "http"
+  config_ncUrl = config_ncUrl.replace("http://", "")
+  config_ncUrl = config_ncUrl.replace("https://", "")
+
+# returns the value of an optional setting, or the default if the setting is missing in config.xml
+def configvalue(name, default):
+  setting = config_xmlsoup.find(name)
+  if setting is None or setting.string is None:
+    return default
+  return setting.string.strip()
 
 # TODO optional: read config from input() if config.xml empty
 # print('Username of creator (admin?):') 
@@ -130,380 +183,1444 @@ requestheaders = {
   'OCS-APIRequest': 'true',
 }
 
-# set/create output-directory
+# Timings of the phases of the import (csv-file, requests, group and user creation, pdf-files, ...)
+# Every phase keeps the duration of each call, for the count, the total time and the percentiles in
+# the report at the end. They show if a slow import is caused by the cloud, the network or the pdf-files.
+class Timings:
+  def __init__(self):
+    self.samples = collections.defaultdict(list)
+    self.lock = threading.Lock()
+
+  def record(self, phase, seconds):
+    with self.lock:
+      self.samples[phase].append(seconds)
+
+  @contextlib.contextmanager
+  def measure(self, phase):
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.record(phase, time.perf_counter() - started)
+
+  # remove and return all durations, the render processes send them to the main process
+  def take(self):
+    with self.lock:
+      samples = dict(self.samples)
+      self.samples.clear()
+    return samples
+
+  def merge(self, samples):
+    with self.lock:
+      for phase, durations in samples.items():
+        self.samples[phase].extend(durations)
+
+  # one row per phase: count, total time in seconds, p50/p95/p99/max in milliseconds
+  def report(self):
+    rows = []
+    with self.lock:
+      for phase, durations in self.samples.items():
+        durations = sorted(durations)
+        percentile = lambda p: round(durations[max(0, math.ceil(p / 100 * len(durations)) - 1)] * 1000, 1)
+        rows.append({'phase': phase, 'count': len(durations), 'total_s': round(sum(durations), 3),
+          'p50_ms': percentile(50), 'p95_ms': percentile(95), 'p99_ms': percentile(99), 'max_ms': percentile(100)})
+    return rows
+
+timings = Timings()
+
+# Connection pools which count the connections they open, to see how many connections
+# (and TLS handshakes) are saved by keep-alive
+class CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+  client = None
+
+  def _new_conn(self):
+    self.client.countconnection()
+    return super()._new_conn()
+
+class CountingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+  client = None
+
+  def _new_conn(self):
+    self.client.countconnection()
+    return super()._new_conn()
+
+class CountingAdapter(requests.adapters.HTTPAdapter):
+  def __init__(self, client, **kwargs):
+    self.client = client
+    super().__init__(**kwargs)
+
+  def init_poolmanager(self, *args, **kwargs):
+    super().init_poolmanager(*args, **kwargs)
+    self.poolmanager.pool_classes_by_scheme = {
+      'http': type('CountingHTTPConnectionPool', (CountingHTTPConnectionPool,), {'client': self.client}),
+      'https': type('CountingHTTPSConnectionPool', (CountingHTTPSConnectionPool,), {'client': self.client}),
+    }
+
+# Request scheduler
+# Token bucket: at most `rate` requests per second (0 = unlimited), bursts up to `burst` requests.
+class TokenBucket:
+  def __init__(self, rate, burst):
+    self.rate = rate
+    self.capacity = max(1, burst)
+    self.tokens = self.capacity
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    if self.rate <= 0:
+      return
+    while True:
+      with self.lock:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        wait = (1 - self.tokens) / self.rate
+      time.sleep(wait)
+
+# Adaptive concurrency: at most `limit` requests at the same time. The limit is halved (at most once
+# per second) when the cloud throttles or fails, and raised by one after `limit` successful requests,
+# up to `maximum`.
+class AdaptiveLimit:
+  def __init__(self, maximum):
+    self.maximum = maximum
+    self.limit = maximum
+    self.active = 0
+    self.successes = 0
+    self.decreased = 0
+    self.condition = threading.Condition()
+
+  def acquire(self):
+    with self.condition:
+      while self.active >= self.limit:
+        self.condition.wait()
+      self.active += 1
+
+  def release(self, throttled):
+    with self.condition:
+      self.active -= 1
+      if throttled:
+        self.successes = 0
+        if time.monotonic() - self.decreased >= 1:
+          self.limit = max(1, self.limit // 2)
+          self.decreased = time.monotonic()
+      else:
+        self.successes += 1
+        if self.limit < self.maximum and self.successes >= self.limit:
+          self.limit += 1
+          self.successes = 0
+      self.condition.notify_all()
+
+# responses which are retried: throttled by the brute-force protection or a proxy (429), server errors (5xx)
+def retryable(response):
+  return response.status_code == 429 or response.status_code >= 500
+
+# seconds to wait before the next attempt: Retry-After of the cloud, or exponential backoff with jitter
+def retrydelay(response, attempt, backoff):
+  retryafter = response.headers.get('Retry-After') if response is not None else None
+  if retryafter:
+    try:
+      return min(config_maxBackoff, max(0.0, float(retryafter)))
+    except ValueError:
+      try:
+        return min(config_maxBackoff, max(0.0, (email.utils.parsedate_to_datetime(retryafter) - datetime.now(timezone.utc)).total_seconds()))
+      except (TypeError, ValueError):
+        pass
+  delay = min(config_maxBackoff, backoff * 2 ** (attempt - 1))
+  return delay / 2 + random.uniform(0, delay / 2)
+
+config_maxBackoff = 60 # seconds, longest wait between two attempts
+
+# Client for the OCS API of the cloud
+# Owns one pooled requests.Session for the whole import, so the connections are kept alive and
+# reused by all requests (and all worker threads) instead of opening a new connection per request.
+# Every request goes through the scheduler: rate limit, adaptive concurrency limit and retries with
+# backoff for throttled requests (429), server errors (5xx), timeouts and connection errors.
+class OCSClient:
+  def __init__(self, url, adminname, adminpass, verify, poolsize=10, timeout=60, retries=3, backoff=0.5, ratelimit=0, concurrency=1):
+    self.url = url
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.bucket = TokenBucket(ratelimit, concurrency)
+    self.limit = AdaptiveLimit(concurrency)
+    self.requests = 0
+    self.retried = 0
+    self.connections = 0
+    self.lock = threading.Lock()
+    self.session = requests.Session()
+    self.session.auth = (adminname, adminpass)
+    self.session.headers.update(requestheaders)
+    self.session.params = {'format': 'json'} # the cloud answers in json, which is parsed much faster than xml
+    self.verify = verify # passed with every request, because session.verify is overruled by REQUESTS_CA_BUNDLE
+    # no retries in urllib3, they are done by request()
+    adapter = CountingAdapter(self, pool_connections=1, pool_maxsize=poolsize, max_retries=0)
+    self.session.mount('http://', adapter)
+    self.session.mount('https://', adapter)
+
+  def countconnection(self):
+    with self.lock:
+      self.connections += 1
+
+  # The number of retries is stored in response.retries. A POST which timed out may have been
+  # executed by the cloud, so its retry can answer "already exists".
+  def request(self, method, path, **kwargs):
+    kwargs.setdefault('timeout', self.timeout)
+    kwargs.setdefault('verify', self.verify)
+    attempt = 0
+    while True:
+      with timings.measure('request: waiting for the scheduler'):
+        self.bucket.acquire()
+        self.limit.acquire()
+      response = None
+      throttled = True
+      try:
+        with self.lock:
+          self.requests += 1
+        with timings.measure('request: cloud and network'):
+          response = self.session.request(method, self.url + path, **kwargs)
+        throttled = retryable(response)
+      except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        if attempt >= self.retries:
+          raise
+      finally:
+        self.limit.release(throttled)
+      if not throttled or attempt >= self.retries:
+        response.retries = attempt
+        return response
+      attempt += 1
+      with self.lock:
+        self.retried += 1
+      time.sleep(retrydelay(response, attempt, self.backoff))
+
+  def get(self, path, **kwargs):
+    return self.request('GET', path, **kwargs)
+
+  def post(self, path, **kwargs):
+    return self.request('POST', path, **kwargs)
+
+  def put(self, path, **kwargs):
+    return self.request('PUT', path, **kwargs)
+
+  def delete(self, path, **kwargs):
+    return self.request('DELETE', path, **kwargs)
+
+  # connections opened vs. reused, for the summary at the end of the import
+  def stats(self):
+    return ("Requests: " + str(self.requests) + " | Retries: " + str(self.retried) + " | Connections opened: " + str(self.connections) +
+      " | Connections reused: " + str(max(0, self.requests - self.connections)) + " | Concurrency at the end: " + str(self.limit.limit))
+
+  def close(self):
+    self.session.close()
+
+client = None # created by main()
+
+# set by main(): output-directory, temporary-directory of this run, date and time of this run as string
 output_dir = 'output'
-if not os.path.exists(output_dir):
-  os.makedirs(output_dir)
-
-# set/create temporary-directory
-tmp_dir = 'tmp'
-if not os.path.exists(tmp_dir):
-  os.makedirs(tmp_dir)
-
-# adds date and time as string to variable
-today = datetime.now().strftime('%Y-%m-%d_%H-%M-%S') 
-
-# Mapping for umlauts and and special characters. The listed umlauts and special characters are automatically converted to a compatible spelling for the user name.
-mapping = {
-           ord(u"Ä"): u"Ae",
-           ord(u"ä"): u"ae",
-           ord(u"Ë"): u"E",
-           ord(u"ë"): u"e",
-           ord(u"Ï"): u"I",
-           ord(u"ï"): u"i",
-           ord(u"Ö"): u"Oe",
-           ord(u"ö"): u"oe",           
-           ord(u"Ü"): u"Ue",
-           ord(u"ü"): u"ue",
-           ord(u"Ÿ"): u"Y",
-           ord(u"ÿ"): u"y",
-           ord(u"ß"): u"ss",
-           ord(u"À"): u"A",
-           ord(u"Á"): u"A",
-           ord(u"Â"): u"A",
-           ord(u"Ã"): u"A",
-           ord(u"Å"): u"A",
-           ord(u"Æ"): u"Ae",
-           ord(u"Ç"): u"C",
-           ord(u"È"): u"E",
-           ord(u"É"): u"E",
-           ord(u"Ê"): u"E",
-           ord(u"Ì"): u"I",
-           ord(u"Í"): u"I",
-           ord(u"Î"): u"I",
-           ord(u"Ð"): u"D",
-           ord(u"Ñ"): u"N",
-           ord(u"Ò"): u"O",
-           ord(u"Ó"): u"O",
-           ord(u"Ô"): u"O",
-           ord(u"Õ"): u"O",
-           ord(u"Ø"): u"Oe",
-           ord(u"Œ"): u"Oe",
-           ord(u"Ù"): u"U",
-           ord(u"Ú"): u"U",
-           ord(u"Û"): u"U",
-           ord(u"Ý"): u"Y",
-           ord(u"Þ"): u"Th",
-           ord(u"à"): u"a",
-           ord(u"á"): u"a",
-           ord(u"â"): u"a",
-           ord(u"ã"): u"a",
-           ord(u"å"): u"a",
-           ord(u"æ"): u"ae",
-           ord(u"ç"): u"c",
-           ord(u"è"): u"e",
-           ord(u"é"): u"e",
-           ord(u"ê"): u"e",
-           ord(u"ì"): u"i",
-           ord(u"í"): u"i",
-           ord(u"î"): u"i",
-           ord(u"ð"): u"d",
-           ord(u"ñ"): u"n",
-           ord(u"ò"): u"o",
-           ord(u"ó"): u"o",
-           ord(u"ô"): u"o",
-           ord(u"õ"): u"o",
-           ord(u"ø"): u"oe",
-           ord(u"œ"): u"oe",
-           ord(u"ù"): u"u",
-           ord(u"ú"): u"u",
-           ord(u"û"): u"u",
-           ord(u"ý"): u"y",
-           ord(u"þ"): u"Th",
-           ord(u"Š"): u"S",
-           ord(u"š"): u"s",
-           ord(u"Č"): u"C",
-           ord(u"č"): u"c"
-           }
-
-# QR-Code class
-qr = qrcode.QRCode(
-    version=1,
-    error_correction=qrcode.constants.ERROR_CORRECT_L,
-    box_size=10,
-    border=4,
-)
-
-# Function: Generate random password
-# This will generate a random password with 1 random uppercase letter, 3 random lowercase letters,
-# 3 random digits, and 1 random special character--this can be adjusted as needed.
-# Then it combines each random character and creates a random order.
-
-# generate more dynamic Password
-# This Funktion is outdated use dynamicPW instead
-def pwgenerator():
-  PWUPP = random.SystemRandom().choice(string.ascii_uppercase)
-  PWLOW1 = random.SystemRandom().choice(string.ascii_lowercase)
-  PWLOW2 = random.SystemRandom().choice(string.ascii_lowercase)
-  PWLOW3 = random.SystemRandom().choice(string.ascii_lowercase)
-  PWDIG1 = random.SystemRandom().choice(string.digits)
-  PWDIG2 = random.SystemRandom().choice(string.digits)
-  PWDIG3 = random.SystemRandom().choice(string.digits)
-  PWSPEC = random.SystemRandom().choice('!@*(§')
-  PWD = None
-  PWD = PWUPP + PWLOW1 + PWLOW2 + PWLOW3 + PWDIG1 + PWDIG2 + PWDIG3 + PWSPEC
-  PWD = ''.join(random.sample(PWD,len(PWD)))
-  return(PWD)
-
-def dynamicPW(length):
-  password = ""
-  for i in range(length):
-    rand_result = [0,0,0,0]
-    rand_result[0] = random.SystemRandom().choice(string.ascii_uppercase)
-    rand_result[1] = random.SystemRandom().choice(string.ascii_lowercase)
-    rand_result[2] = random.SystemRandom().choice(string.digits)
-    rand_result[3] = random.SystemRandom().choice('!@*(§')
-    password = password + rand_result[random.randint(0,3)]
-  return(password)
+tmp_dir = None
+today = None
 
-# display expected results before executing CURL
+# Function: QR-Code for the login with the Nextcloud apps
+# Drawn in memory with the QR-Code widget of reportlab (nothing is written to disk) and cached,
+# so a pdf-file which is rendered again (e.g. after --resume) does not encode the QR-Code again.
+
+@functools.lru_cache(maxsize=256)
+def qrdrawing(payload, size):
+  widget = QrCodeWidget(payload, barLevel='L', barBorder=4)
+  x1, y1, x2, y2 = widget.getBounds()
+  drawing = Drawing(size, size, transform=[size / (x2 - x1), 0, 0, size / (y2 - y1), 0, 0])
+  drawing.add(widget)
+  return drawing
+
+# Exception for errors which end the whole import (wrong config, cloud not reachable).
+# It is raised in the worker threads and reported by the main thread, because sys.exit()
+# would only end the worker thread.
+class FatalError(Exception):
+  pass
+
+# is set as soon as a worker hits a fatal error, so the remaining rows are not sent anymore
+abort = threading.Event()
+
+def fatal(*lines):
+  abort.set()
+  return FatalError(*lines)
+
+# Functions for the requests to the OCS API
+# Errors of the request end the whole import.
+
+def ocsresponse(method, path, **kwargs):
+  try:
+    response = client.request(method, path, **kwargs)
+  except requests.exceptions.RequestException as e:  # handling errors
+    raise fatal(str(e), "The CURL request could not be performed.")
+
+  # catch wrong config
+  if response.status_code != 200:
+    raise fatal("HTTP Status: " + str(response.status_code), "Your config.xml is wrong or your cloud is not reachable.")
+
+  return response
+
+def ocsrequest(method, path, **kwargs):
+  return ocsparse(ocsresponse(method, path, **kwargs))
+
+# Parsed answer of the OCS API: status ("ok"/"failure"), statuscode (e.g. "100"), message, data
+# (dicts, lists and strings, e.g. {'users': ['admin', ...]} when loading the users) and the number
+# of retries of the request.
+OCSResult = collections.namedtuple('OCSResult', ['status', 'statuscode', 'message', 'data', 'retries'])
+
+# Function: parse an answer of the OCS API
+# The requests ask for json (format=json). Clouds or proxies which answer in xml anyway are parsed
+# with ElementTree, which gives the same OCSResult.
+def ocsparse(response):
+  try:
+    if 'json' in response.headers.get('Content-Type', ''):
+      ocs = response.json()['ocs']
+      meta = ocs['meta']
+      return OCSResult(meta['status'], str(meta['statuscode']), meta.get('message') or '', ocs['data'], response.retries)
+    ocs = ElementTree.fromstring(response.content)
+    return OCSResult(ocs.findtext('meta/status', ''), ocs.findtext('meta/statuscode', ''),
+      ocs.findtext('meta/message', ''), xmldata(ocs.find('data')), response.retries)
+  except (ValueError, KeyError, TypeError, ElementTree.ParseError):
+    raise fatal("Unexpected answer of the cloud: " + response.text[:200], "Your config.xml is wrong or your cloud is not reachable.")
+
+# data of an xml-answer in the structure of the json-answer: <element>-lists become lists,
+# other elements become dicts, elements without children become strings
+def xmldata(element):
+  if element is None:
+    return ''
+  children = list(element)
+  if not children:
+    return (element.text or '').strip()
+  if all(child.tag == 'element' for child in children):
+    return [xmldata(child) for child in children]
+  return {child.tag: xmldata(child) for child in children}
+
+# detailed info of a response, e.g. "ok 100 = OK"
+def ocsstatus(result):
+  return result.status + ' ' + result.statuscode + ' = ' + result.message
+
+# Function: load a list (users or groups) with paginated requests
+config_pagesize = 500 # entries per request when loading the existing users and groups
+
+def loadlist(path, key):
+  entries = []
+  offset = 0
+  while True:
+    result = ocsrequest('GET', path, params={'limit': config_pagesize, 'offset': offset})
+    page = (result.data.get(key) if isinstance(result.data, dict) else None) or []
+    entries.extend(page)
+    if len(page) < config_pagesize:
+      return entries
+    offset += config_pagesize
+
+# split a list of groups from the csv-file (e.g. "Lehrkraefte,jg01a") into single groups
+def splitgroups(value):
+  if not value:
+    return []
+  return [group.strip() for group in html.escape(value).split(config_csvDelimiterGroups) if group.strip()] # Groups in the CSV-file are split by semicolon --> load into list
+
+# Pre-flight: users and groups which already exist in the cloud
+# Both are loaded once before the import. Groups which are created during the import are added,
+# so every group is checked against the cloud at most once.
+knownusers = set() # lowercase, user ids are not case sensitive in Nextcloud
+knowngroups = set()
+groupslock = threading.Lock()
+
+def loadusers():
+  knownusers.update(userid.lower() for userid in loadlist(config_apiUrl, 'users'))
+
+def loadgroups():
+  knowngroups.update(loadlist(config_apiUrlGroups, 'groups'))
+
+# what happens with a csv-row: 'create' a new user, 'skip' or 'update' an existing user or only add
+# the 'groups' (see existingusers)
+# With --sync a user of the last import, who still exists in the cloud, is 'unchanged' or gets only
+# the changes ('sync').
+def rowaction(user):
+  if user.userid.lower() in knownusers:
+    previous = snapshot.get(user) if args.sync else None
+    if previous is not None:
+      unchanged = previous['hash'] == snapshotentry(user)['hash'] and not previous.get('disabled')
+      return 'unchanged' if unchanged else 'sync'
+    return config_existingUsers
+  return 'create'
+
+# Function: create a group, if it does not exist yet
+# Runs in a worker thread of the group stage. Returns the message for the console, or None if the
+# group already exists.
+
+def creategroup(group):
+  if group in knowngroups or abort.is_set():
+    return None
+  # one lock per group: different groups are created at the same time, a group only once
+  with groupslock:
+    lock = grouplocks[group]
+  with lock:
+    if group in knowngroups:
+      return None
+    groupdata = {
+      'groupid':group
+    }
+    with timings.measure('group create'):
+      result = ocsrequest('POST', config_apiUrlGroups, data=groupdata)
+    if result.statuscode in ("100", "102"): # 102: the group exists already
+      knowngroups.add(group)
+
+  # show detailed info of response (create group)
+  return 'Create group "' + group + '": ' + ocsstatus(result)
+
+grouplocks = collections.defaultdict(threading.Lock)
+
+# Group stage
+# Before the users are sent, the groups of all rows which are sent (groups and group admin rights)
+# are collected, and the missing groups are created once, config_concurrency at the same time. The
+# rows only use existing groups afterwards.
+def groupstage(jobs, executor, results):
+  groups = set()
+  for user, action in jobs:
+    if action in ('create', 'update', 'groups', 'sync'):
+      groups.update(user.groups)
+      groups.update(user.subadmin)
+  missing = sorted(groups - knowngroups)
+  if not missing:
+    return
+  print("Creating " + str(len(missing)) + " groups...")
+  futures = [(group, executor.submit(creategroup, group)) for group in missing]
+  for group, future in futures:
+    message = future.result() # a fatal error stops the import before any user is sent
+    if message:
+      print(message)
+      results['groups created' if group in knowngroups else 'groups failed'] += 1
+  print("")
+
+# Result of a csv-row which has been sent to the cloud: messages for the console, the parsed response
+# (of the user request, None for updates), if the row has been applied (user created, updated,
+# removed), the time for the row in seconds and the retries of its requests
+RowResult = collections.namedtuple('RowResult', ['messages', 'ocsresult', 'ok', 'latency', 'retries'])
+
+# Function: create the user of one csv-row
+# The groups have been created by the group stage. Runs in a worker thread. Returns a RowResult, or
+# None if the row has been skipped because of a fatal error in another row.
+
+def createuser(user):
+  if abort.is_set():
+    return None
+  started = time.monotonic()
+  messages = []
+
+  # build the dataset for the request
+  data = [
+    ('userid', user.userid),
+    ('displayName', user.displayname), 
+    ('password', user.password),
+    ('email', user.email),
+    ('quota', user.quota),
+    ('language', config_language)
+  ]
+
+  # if value exists: append single groups to data array/list for CURL
+  for group in user.groups:
+    data.append(('groups[]', group)) # groups is parameter NC API
+
+  # if value exists: append group admin values to data array/list for CURL
+  for groupadmin in user.subadmin:
+    data.append(('subadmin[]', groupadmin)) # subadmin is parameter NC API
+
+  # perform the request
+  with timings.measure('user create'):
+    result = ocsrequest('POST', config_apiUrl, data=data)
+  created = result.statuscode == "100"
+  # the user did not exist before the import, so "already exists" after a retry means the attempt which timed out has created it
+  if result.statuscode == "102" and result.retries > 0:
+    messages.append("The user has been created by an earlier attempt, which did not get an answer in time.")
+    created = True
+  return RowResult(messages, result, created, time.monotonic() - started, result.retries)
+
+# Changes of existing users
+# The requests which change an existing user (update, add to group, group admin, ...) are planned per
+# row and queued one by one, so the changes of a row are sent at the same time like the rows.
+Change = collections.namedtuple('Change', ['message', 'method', 'path', 'data'])
+
+class UserChanges:
+  def __init__(self, user):
+    self.userpath = config_apiUrl + '/' + urllib.parse.quote(user.userid, safe='')
+    self.changes = []
+
+  def enable(self):
+    self.changes.append(Change('Enable', 'PUT', self.userpath + '/enable', None))
+
+  def setvalue(self, key, value):
+    self.changes.append(Change('Update ' + key, 'PUT', self.userpath, {'key': key, 'value': value}))
+
+  def addgroup(self, group):
+    self.changes.append(Change('Add to group "' + group + '"', 'POST', self.userpath + '/groups', {'groupid': group}))
+
+  def removegroup(self, group):
+    self.changes.append(Change('Remove from group "' + group + '"', 'DELETE', self.userpath + '/groups', {'groupid': group}))
+
+  def addsubadmin(self, group):
+    self.changes.append(Change('Group admin for "' + group + '"', 'POST', self.userpath + '/subadmins', {'groupid': group}))
+
+  def removesubadmin(self, group):
+    self.changes.append(Change('No more group admin for "' + group + '"', 'DELETE', self.userpath + '/subadmins', {'groupid': group}))
+
+# Function: the changes of an existing user for existingusers == update (display name, email, quota,
+# groups and group admin rights, the password is not changed) or existingusers == groups (only groups
+# and group admin rights)
+
+def updatechanges(user, action):
+  changes = UserChanges(user)
+
+  if action == 'update':
+    for key, value in (('displayname', user.displayname), ('email', user.email), ('quota', user.quota)):
+      if value:
+        changes.setvalue(key, value)
+
+  for group in user.groups:
+    changes.addgroup(group)
+
+  for groupadmin in user.subadmin:
+    changes.addsubadmin(groupadmin)
+
+  return changes.changes
+
+# Function: only the changes of a user since the last import (--sync)
+# Changed fields are updated, groups and group admin rights are added and removed.
+
+def syncchanges(user):
+  previous = snapshot.get(user)
+  changes = UserChanges(user)
+
+  # disabled by an earlier import, because the user was not in the csv-file
+  if previous.get('disabled'):
+    changes.enable()
+
+  for key in ('displayname', 'email', 'quota'):
+    if getattr(user, key) != previous[key]:
+      changes.setvalue(key, getattr(user, key))
+
+  for group in user.groups:
+    if group not in previous['groups']:
+      changes.addgroup(group)
+  for group in previous['groups']:
+    if group not in user.groups:
+      changes.removegroup(group)
+
+  for groupadmin in user.subadmin:
+    if groupadmin not in previous['subadmin']:
+      changes.addsubadmin(groupadmin)
+  for groupadmin in previous['subadmin']:
+    if groupadmin not in user.subadmin:
+      changes.removesubadmin(groupadmin)
+
+  return changes.changes
+
+# Function: send one change of an existing user
+# Runs in a worker thread. Returns the change, the parsed response and the start and end time, or None
+# if the change has been skipped because of a fatal error in another row.
+
+def sendchange(change):
+  if abort.is_set():
+    return None
+  started = time.monotonic()
+  with timings.measure('user change'):
+    result = ocsrequest(change.method, change.path, data=change.data)
+  return change, result, started, time.monotonic()
+
+# Function: the RowResult of a row from the results of its changes (None if a change has been skipped)
+def changesresult(futures):
+  sent = [future.result() for future in futures]
+  if None in sent:
+    return None
+  if not sent:
+    return RowResult([], None, True, 0, 0)
+  return RowResult(
+    [change.message + ': ' + ocsstatus(result) for change, result, started, finished in sent],
+    None,
+    all(result.statuscode == "100" for change, result, started, finished in sent),
+    max(finished for change, result, started, finished in sent) - min(started for change, result, started, finished in sent),
+    sum(result.retries for change, result, started, finished in sent))
+
+# Function: disable or delete a user who is no longer in the csv-file (--sync, see removedusers)
+# Runs in a worker thread like createuser.
+
+def removeuser(user):
+  if abort.is_set():
+    return None
+  started = time.monotonic()
+  userpath = config_apiUrl + '/' + urllib.parse.quote(user.userid, safe='')
+  with timings.measure('user remove'):
+    if config_removedUsers == 'delete':
+      result = ocsrequest('DELETE', userpath)
+    else:
+      result = ocsrequest('PUT', userpath + '/disable')
+  return RowResult([], result, result.statuscode == "100", time.monotonic() - started, result.retries)
+
+# Import log
+# One json-object per csv-row in output/output.log (row, userid, status, latency_ms, retries, ...).
+# The records go through a queue to a listener thread, which writes them into the file: the file is
+# opened once for the whole import, written with a buffer and flushed every config_logFlush seconds
+# (also while no records arrive, e.g. during a backoff or while waiting for the pdf-files) and at the
+# end. Logging never waits for the disk (e.g. a network share).
+logger = logging.getLogger('nc-userimporter')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+loglistener = None
+
+class JsonFormatter(logging.Formatter):
+  def format(self, record):
+    return json.dumps(dict(time=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)), **record.msg))
+
+class BufferedFileHandler(logging.FileHandler):
+  def __init__(self, path, interval):
+    super().__init__(path, mode='a', encoding='utf-8')
+    self.interval = interval
+    self.flushed = time.monotonic()
+    self.unflushed = False
 
-def showuser():  
-  usertable = [["Username","Display name","Password","Email","Groups","Group admin for","Quota"]]
-  with codecs.open(os.path.join(appdir, config_csvfile),mode='r', encoding='utf-8') as csvfile:
-    readCSV = csv.reader(csvfile, delimiter=config_csvDelimiter)
+  # like FileHandler.emit, but flushed at most every `interval` seconds
+  def emit(self, record):
+    try:
+      self.stream.write(self.format(record) + self.terminator)
+      self.unflushed = True
+      if time.monotonic() - self.flushed >= self.interval:
+        self.flush()
+    except Exception:
+      self.handleError(record)
+
+  def flush(self):
+    super().flush()
+    self.unflushed = False
+    self.flushed = time.monotonic()
+
+# listener thread which flushes the file every `interval` seconds, also when no new records arrive
+class FlushingQueueListener(logging.handlers.QueueListener):
+  def __init__(self, records, handler, interval):
+    super().__init__(records, handler)
+    self.interval = interval
+
+  def dequeue(self, block):
+    while True:
+      try:
+        return self.queue.get(block, timeout=self.interval if block else None)
+      except queue.Empty:
+        if not block:
+          raise
+        for handler in self.handlers:
+          if handler.unflushed:
+            handler.flush()
+
+def startlog(path):
+  global loglistener
+  queuehandler = logging.handlers.QueueHandler(queue.SimpleQueue())
+  queuehandler.setFormatter(JsonFormatter()) # the listener writes the formatted lines as they are
+  logger.addHandler(queuehandler)
+  loglistener = FlushingQueueListener(queuehandler.queue, BufferedFileHandler(path, config_logFlush), config_logFlush)
+  loglistener.start()
+
+# write the remaining records and close the file
+def stoplog():
+  loglistener.stop()
+  for handler in loglistener.handlers:
+    handler.close()
+  for handler in list(logger.handlers):
+    logger.removeHandler(handler)
+
+def logrow(user, status, **values):
+  logger.info(dict(row=user.number, userid=user.userid, status=status, **values))
+
+# Import journal
+# Records the state of every csv-row in output/journal_<hash of the csv-file>.jsonl, so an aborted import
+# (network error, [CONTROL + C], crash) can be continued with --resume without sending rows or
+# generating pdf-files again. States: pending (before the user is sent), group-ok (before the user is sent, all its groups exist),
+# created (user created), pdf-done (pdf-file written) and the final states skipped, updated and failed.
+class Journal:
+  def __init__(self, path):
+    self.path = path
+    self.rows = {}
+    self.file = None
+    self.unsynced = 0
+    self.lock = threading.Lock()
+
+  # read the states of the last run
+  def load(self):
+    if not os.path.isfile(self.path):
+      return
+    with codecs.open(self.path, mode='r', encoding='utf-8') as journalfile:
+      for line in journalfile:
+        try:
+          record = json.loads(line)
+        except ValueError: # the last line of a crashed run may be incomplete
+          continue
+        self.rows.setdefault(record['row'], {}).update(record)
+
+  # all values recorded for a row, the latest state in 'state'
+  def state(self, number):
+    return self.rows.get(number, {})
+
+  def open(self, resume):
+    self.file = codecs.open(self.path, mode='a' if resume else 'w', encoding='utf-8')
+
+  def record(self, user, state, **values):
+    record = dict(row=user.number, userid=user.userid, state=state, time=time.strftime("%d.%m.%Y %H:%M:%S"), **values)
+    with self.lock:
+      self.rows.setdefault(user.number, {}).update(record)
+      # flushed at once to survive a crash of the script, synced to disk every config_journalsync records
+      self.file.write(json.dumps(record) + "\n")
+      self.file.flush()
+      self.unsynced += 1
+      if self.unsynced >= config_journalsync:
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+  def close(self, finished):
+    with self.lock:
+      self.file.close()
+    if finished:
+      os.remove(self.path)
+
+config_journalsync = 50
+
+journal = None # created by main()
+
+# what happens with a csv-row in this run: 'create', 'skip' or 'update' (see rowaction),
+# 'pdf' if the user has been created in the last run but the pdf-file is missing,
+# 'done' if the row has been finished in the last run
+def jobaction(user):
+  previous = journal.state(user.number).get('state')
+  if previous in ('pdf-done', 'skipped', 'updated', 'synced', 'failed'):
+    return 'done'
+  if previous == 'created':
+    return 'pdf'
+  if previous in ('pending', 'group-ok') and user.userid.lower() in knownusers:
+    return 'pdf' # the user has been created, but the last run stopped before the response was recorded
+  return rowaction(user)
+
+# Letter template
+# The template (config_letterTemplate) is loaded once: the logo is decoded once, the styles are
+# created once and the paragraphs without placeholders are parsed once. For every user only the
+# paragraphs with placeholders and the QR-Code are created, the other flowables are copied.
+letter = None
+
+def loadletter():
+  global letter
+  with codecs.open(os.path.join(appdir, config_letterTemplate),mode='r', encoding='utf-8') as letterfile:
+    letter_xmlsoup = BeautifulSoup(letterfile.read(), "html.parser")
+  styles=getSampleStyleSheet()
+  styles.add(ParagraphStyle(name='Justify', alignment=TA_JUSTIFY))
+  letter = []
+  for element in letter_xmlsoup.find('letter').find_all(True, recursive=False):
+    if element.name == 'logo':
+      with open(os.path.join(appdir, element.string.strip()), 'rb') as logofile:
+        logo = io.BytesIO(logofile.read()) # read and decoded once, shared by all pdf-files
+      letter.append(Image(logo, float(element['width']), float(element['height'])))
+    elif element.name == 'spacer':
+      letter.append(Spacer(1, float(element['height'])))
+    elif element.name == 'paragraph':
+      ptext = element.decode_contents().strip()
+      if element.get('size'):
+        ptext = '<font size=%s>%s</font>' % (element['size'], ptext)
+      style = styles[element.get('style', 'Normal')]
+      if '{' in ptext:
+        letter.append(lambda values, ptext=ptext, style=style: Paragraph(ptext.format(**values), style)) # created for every user
+      else:
+        letter.append(Paragraph(ptext, style))
+    elif element.name == 'qrcode':
+      size = float(element.get('size', 150))
+      letter.append(lambda values, size=size: qrflowable(values['qrcode'], size)) # created for every user
+
+def qrflowable(payload, size):
+  with timings.measure('pdf: QR-Code'):
+    return copy.copy(qrdrawing(payload, size))
+
+# Function: the pdf-content with the login data of a created user
+# Returns the flowables of this user only, so the pdf-file of a user never contains other users.
+
+def userstory(user):
+  if letter is None:
+    loadletter()
+  values = {
+    'username': user.userid, # loginname
+    'displayname': user.displayname, # username
+    'password': user.password, # password
+    'link': config_protocol + "://" + config_ncUrl, # adds nextcloud-url
+    'qrcode': "nc://login/user:" + user.userid + "&password:" + user.password + "&server:" + config_protocol + "://" + config_ncUrl,
+  }
+  story = []
+  for flowable in letter:
+    if callable(flowable):
+      story.append(flowable(values))
+    else:
+      story.append(copy.copy(flowable)) # a flowable keeps its layout, so every page gets a copy
+  return story
+
+# Function: render the pdf-content of one or more users into a pdf-file
+# Runs in a process of the render stage (or in the main process if pdfWorkers == 0). A render process
+# returns its timings to the main process.
+
+def renderpdf(output_filepath, users, topmargin):
+  story = []
+  for user in users:
+    if story:
+      story.append(PageBreak())
+    with timings.measure('pdf: letter'):
+      story.extend(userstory(user))
+  doc = SimpleDocTemplate(output_filepath,pagesize=A4,
+                          rightMargin=72,leftMargin=72,
+                          topMargin=topmargin,bottomMargin=18)
+  with timings.measure('pdf: build'):
+    doc.build(story)
+  if renderprocess:
+    return timings.take()
+  return None
+
+renderprocess = False # True in the processes of the render stage
+
+# Function: prepare a process of the render stage
+# A process which is started with spawn imports the script without running main(), so it gets the
+# settings for the letter here. A forked process has them already.
+
+def initrender(protocol, ncurl, lettertemplate, parent):
+  global config_protocol, config_ncUrl, config_letterTemplate, renderprocess
+  config_protocol = protocol
+  config_ncUrl = ncurl
+  config_letterTemplate = lettertemplate
+  renderprocess = True
+  threading.Thread(target=watchparent, args=(parent,), daemon=True).start()
+  timings.take() # a forked process starts with a copy of the timings of the main process
+  if letter is None:
+    loadletter()
+
+# Function: end a process of the render stage when the main process has died (SIGKILL, out of memory),
+# otherwise it would wait for work forever and keep its memory and the output of the script open
+def watchparent(parent):
+  while os.getppid() == parent:
+    time.sleep(1)
+  os._exit(1)
+
+# Render stage
+# The pdf-files of the created users are rendered in config_pdfWorkers processes, so rendering runs on
+# all cores and at the same time as the requests to the cloud. pdfOneDoc == yes: the users are rendered
+# in chunks of config_pdfChunkSize users into pdf-files in the temporary directory of the csv-file.
+# Every finished chunk is recorded in the journal, so --resume reuses the chunks of an aborted import.
+# At the end all chunks are concatenated into the one pdf-file (see Pdf_concatenator.py), so the memory
+# depends on the chunk size, not on the number of users.
+class PdfRenderer:
+  def __init__(self, workers, chunksize):
+    self.chunksize = chunksize
+    self.chunk = [] # users for the next chunk (one document)
+    self.jobs = [] # (users, future) of all rendered pdf-files
+    self.pool = None
+    # the processes are forked where possible (fast start, the letter template is already loaded),
+    # otherwise (Windows) spawned, see initrender
+    if workers > 0:
+      method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+      self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method),
+        initializer=initrender, initargs=(config_protocol, config_ncUrl, config_letterTemplate, os.getpid()))
+      # start the processes now, forking while the request threads are running is not safe
+      self.pool.submit(int).result()
+
+  def submit(self, output_filepath, users, topmargin, chunk):
+    if self.pool is not None:
+      future = self.pool.submit(renderpdf, output_filepath, users, topmargin)
+    else:
+      future = Future()
+      try:
+        future.set_result(renderpdf(output_filepath, users, topmargin))
+      except Exception as e:
+        future.set_exception(e)
+    future.add_done_callback(self.timed)
+    def journaldone(future):
+      if future.exception() is None:
+        self.done(users, output_filepath if chunk else None)
+    future.add_done_callback(journaldone)
+    self.jobs.append((users, future))
+    return future
+
+  # timings of a render process
+  def timed(self, future):
+    if future.exception() is None and future.result():
+      timings.merge(future.result())
+
+  def done(self, users, chunkfile):
+    for user in users:
+      if chunkfile:
+        journal.record(user, 'pdf-done', chunk=os.path.basename(chunkfile))
+      else:
+        journal.record(user, 'pdf-done')
+
+  # add a created user
+  def add(self, user):
+    if config_pdfOneDoc == 'no':
+      output_filename = user.userid + "_" + today + ".pdf"
+      self.submit(os.path.join( output_dir, output_filename ), [user], 52, False)
+    else:
+      self.chunk.append(user)
+      if len(self.chunk) >= self.chunksize:
+        self.flushchunk()
+
+  def flushchunk(self):
+    if self.chunk:
+      chunkfile = os.path.join( tmp_dir, "chunk_" + str(self.chunk[0].number) + ".pdf" )
+      self.submit(chunkfile, self.chunk, 72, True)
+      self.chunk = []
+
+  def outputpath(self):
+    return os.path.join( output_dir, "userlist_" + today + ".pdf" )
+
+  # wait until all pdf-files are rendered, write the one pdf-file (one document)
+  # Returns the error messages of pdf-files which could not be rendered.
+  def finish(self):
+    self.flushchunk()
+    errors = []
+    for users, future in self.jobs:
+      if future.exception() is not None:
+        errors.append("ERROR: the pdf-file for " + ", ".join(user.userid for user in users) + " could not be created: " + str(future.exception()))
+    if self.pool is not None:
+      self.pool.shutdown()
+    if config_pdfOneDoc != 'no' and not errors:
+      self.writedocument()
+    return errors
+
+  # concatenate the chunks of this run and of the aborted runs (--resume) in the order of the csv-file
+  # The chunks are deleted afterwards, a chunk which is missing is already in an earlier pdf-file.
+  def writedocument(self):
+    firstrow = {}
+    for record in journal.rows.values():
+      if record.get('state') == 'pdf-done' and record.get('chunk'):
+        firstrow[record['chunk']] = min(record['row'], firstrow.get(record['chunk'], record['row']))
+    chunkfiles = [os.path.join( tmp_dir, chunk ) for chunk in sorted(firstrow, key=firstrow.get)]
+    chunkfiles = [chunkfile for chunkfile in chunkfiles if os.path.isfile(chunkfile)]
+    if not chunkfiles:
+      return
+    partfile = os.path.join( tmp_dir, "userlist.pdf.part" )
+    with timings.measure('pdf: merge'):
+      document = PdfConcatenator(partfile)
+      for chunkfile in chunkfiles:
+        document.append(chunkfile)
+      document.close()
+    os.replace(partfile, self.outputpath())
+    for chunkfile in chunkfiles:
+      os.remove(chunkfile)
+
+# CSV reader stage
+# The csv-file is read once: every row is decoded, checked, normalized (see Username_normalizer.py) and turned into a
+# User record. The preview, the import and the pdf-files all work with these records. All values are
+# html-escaped, groups and group admin values are split into tuples.
+User = collections.namedtuple('User', ['number', 'userid', 'displayname', 'password', 'email', 'groups', 'subadmin', 'quota', 'generated', 'csvuserid'])
+
+# decode the lines of the csv-file and add them to the hash of the file (for the journal)
+def decodelines(csvfile, csvhash):
+  for line in csvfile:
+    csvhash.update(line)
+    yield line.decode('utf-8')
+
+def readusers(path, csvhash):
+  with open(path, 'rb') as csvfile:
+    readCSV = csv.reader(decodelines(csvfile, csvhash), delimiter=config_csvDelimiter)
     next(readCSV, None)  # skip the headers
-    for row in readCSV:
+    for number, row in enumerate(readCSV, 1):
+      if not row: # empty line
+        continue
       if (len(row) != 7): # check if number of columns is consistent
-        print("ERROR: row for user",html.escape(row[0]),"has",len(row),"columns. Should be 7. Please correct your csv-file.")
-        input("Press [ANY KEY] to confirm and end the process.")
-        sys.exit(1)
-      pass_anon = html.escape(row[2])
-      if len(pass_anon) > 0:
-        pass_anon = "*" * (len(pass_anon)) # replace password for display on CLI
-      line = html.escape(row[0])
-      row[0] = line.translate(mapping) # convert special characters and umlauts
-      currentuser = [html.escape(row[0]),html.escape(row[1]),pass_anon,html.escape(row[3]),html.escape(row[4]),html.escape(row[5]),html.escape(row[6])]
-      usertable.append(currentuser)
+        raise FatalError("ERROR: row for user " + html.escape(row[0]) + " has " + str(len(row)) + " columns. Should be 7. Please correct your csv-file.")
+      yield User(
+        number=number,
+        userid=normalize(html.escape(row[0])), # convert special characters and umlauts
+        displayname=html.escape(row[1]),
+        password=html.escape(row[2]),
+        email=html.escape(row[3]),
+        groups=tuple(splitgroups(row[4])),
+        subadmin=tuple(splitgroups(row[5])),
+        quota=html.escape(row[6]),
+        generated=False,
+        csvuserid=row[0], # the user name as written in the csv-file, for messages
+      )
+
+# Snapshot of the last import
+# Keeps the values of every user which the importer has applied to a cloud (created, updated or synced)
+# from a csv-file: user name, display name, email, quota, groups, group admin rights and a hash over these
+# values, never the password. With --sync only the differences to the snapshot are sent: new users are
+# created, changed users get only the changes and users who are no longer in the csv-file are disabled or
+# deleted (removedusers). Users which have only been skipped are not in the snapshot, so they are never
+# removed. The snapshot is written when an import has finished, rows which failed or have been skipped
+# keep their values of the last import.
+class Snapshot:
+  def __init__(self, path):
+    self.path = path
+    self.users = {} # lowercase user name: values of the last import
+
+  def load(self):
+    if not os.path.isfile(self.path):
+      return
+    with codecs.open(self.path, mode='r', encoding='utf-8') as snapshotfile:
+      for line in snapshotfile:
+        entry = json.loads(line)
+        self.users[entry['userid'].lower()] = entry
+
+  def get(self, user):
+    return self.users.get(user.userid.lower())
+
+  # replaces the snapshot file at once, a crash never leaves half a snapshot
+  def save(self, users):
+    with codecs.open(self.path + '.tmp', mode='w', encoding='utf-8') as snapshotfile:
+      for entry in users.values():
+        snapshotfile.write(json.dumps(entry) + "\n")
+    os.replace(self.path + '.tmp', self.path)
+
+snapshot = None # created by main()
+
+# the values of a user in the snapshot
+# 'created' marks users which the importer has created (in this or an earlier import), see checkusernames.
+def snapshotentry(user, created=False):
+  entry = dict(userid=user.userid, displayname=user.displayname, email=user.email, quota=user.quota,
+    groups=list(user.groups), subadmin=list(user.subadmin))
+  entry['hash'] = hashlib.sha256(json.dumps(entry, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+  if created or (snapshot.get(user) or {}).get('created'):
+    entry['created'] = True
+  return entry
+
+# a user of the snapshot as User record
+def snapshotuser(entry):
+  return User(number=None, userid=entry['userid'], displayname=entry['displayname'], password='', email=entry['email'],
+    groups=tuple(entry['groups']), subadmin=tuple(entry['subadmin']), quota=entry['quota'], generated=False, csvuserid=entry['userid'])
+
+# users of the last import who are no longer in the csv-file and still exist in the cloud (only with --sync)
+def removedusers(users):
+  if not args.sync or config_removedUsers not in ('disable', 'delete'):
+    return []
+  userids = {user.userid.lower() for user in users}
+  return [snapshotuser(entry) for key, entry in snapshot.users.items()
+    if key not in userids and key in knownusers and not entry.get('disabled')]
+
+# Function: check that every row gets a user name of its own
+# Rows with the same user name after the conversion (Müller and Mueller) end the import before anything
+# is sent. Rows which only match a user of the cloud after the conversion are shown, they are handled
+# as existing user (see rowaction). Users which the importer has created itself are not shown.
+def checkusernames(users):
+  # users which the importer has created in an earlier import (snapshot) or in the last run (journal)
+  imported = {key for key, entry in snapshot.users.items() if entry.get('created')}
+  imported.update(record['userid'].lower() for record in journal.rows.values() if record.get('state') in ('created', 'pdf-done'))
+  collisions = findcollisions(((user.number, user.csvuserid, user.userid) for user in users), knownusers - imported)
+  rows = {user.number: user for user in users}
+  errors = []
+  for collision in collisions:
+    if collision.other is None:
+      print("ATTENTION: row " + str(collision.row) + " (" + collision.original + ") gets the user name " + collision.userid +
+        ", which already exists in your cloud. The row is handled as existing user (" + rowaction(rows[collision.row]) + ").")
+    else:
+      errors.append("ERROR: row " + str(collision.row) + " (" + collision.original + ") gets the same user name as row " +
+        str(collision.other) + ": " + collision.userid + ". Please correct your csv-file.")
+  if collisions:
+    print("")
+  if errors:
+    raise FatalError(*errors)
+
+# generate the passwords of the new users without password (if generatePassword == yes)
+# The passwords for the whole csv-file are generated in one batch, see Password_generator.py.
+def withpasswords(users):
+  if config_GeneratePassword != 'yes':
+    return users
+  try:
+    generator = PasswordGenerator(config_passwordLength, config_passwordClasses, config_passwordSpecial)
+  except ValueError as e:
+    raise FatalError("ERROR: " + str(e) + ". Please correct the password settings in your config.xml.")
+  # only users which are created get a password (existing users keep theirs), the password of the last
+  # run is reused, the user may already have been created with it
+  created = {user.number for user in users if not user.password and jobaction(user) in ('create', 'pdf')}
+  missing = [user for user in users if user.number in created and not journal.state(user.number).get('password')]
+  passwords = iter(generator.generate(len(missing)))
+  return [user._replace(password=journal.state(user.number).get('password') or next(passwords), generated=True)
+    if user.number in created else user for user in users]
+
+# display expected results before executing CURL
+# Big csv-files are summarized: only the first config_previewRows users are shown in the table.
+# Returns the number of rows per action.
+
+def showuser(users, removed):  
+  usertable = [["Username","Display name","Password","Email","Groups","Group admin for","Quota","Action"]]
+  actions = {'create': 0, 'skip': 0, 'update': 0, 'groups': 0, 'sync': 0, 'unchanged': 0, 'pdf': 0, 'done': 0, 'remove': len(removed)}
+  groups = set()
+  for user in users:
+    action = jobaction(user)
+    actions[action] += 1
+    groups.update(user.groups)
+    groups.update(user.subadmin)
+    if config_previewRows == 0 or len(usertable) <= config_previewRows:
+      pass_anon = "" if user.generated else "*" * len(user.password) # replace password for display on CLI
+      usertable.append([user.userid,user.displayname,pass_anon,user.email,config_csvDelimiterGroups.join(user.groups),config_csvDelimiterGroups.join(user.subadmin),user.quota,action])
   print(tabulate(usertable,headers="firstrow"))
+  if len(users) > len(usertable) - 1:
+    print("... and " + str(len(users) - len(usertable) + 1) + " more users (change previewrows in your config.xml to see all users)")
+  print("\nUsers in the csv-file: " + str(len(users)) + " | Groups: " + str(len(groups)) + " | Groups to create: " + str(len(groups - knowngroups)))
+  print("New users: " + str(actions['create']) + " | Existing users to skip: " + str(actions['skip']) + " | Existing users to update: " + str(actions['update'] + actions['groups']))
+  if args.sync:
+    print("Changed users since the last import: " + str(actions['sync']) + " | Unchanged users: " + str(actions['unchanged']) +
+      " | Users to " + config_removedUsers + " (no longer in the csv-file): " + str(len(removed)))
+  if args.resume:
+    print("Resumed from the last run: " + str(actions['done']) + " rows already imported, " + str(actions['pdf']) + " pdf-files missing")
 
   # ask user to check values and continue
   print("\nPlease check if the users and groups above are as expected and should be created like that.")
   if not config_GeneratePassword == 'yes':
     print ("ATTENTION: You have specified that users for whom no password has been entered will receive an e-mail to set a password for themselves. Please make absolutely sure that a correct e-mail address is entered for every user for whom no password has been set!")
-  input("If everything is fine, press [ANY KEY] to continue. If not, press [CONTROL + C] to cancel.")
+  if args.dry_run:
+    return actions
+  pause("If everything is fine, press [ANY KEY] to continue. If not, press [CONTROL + C] to cancel.")
   print("\nYou confirmed. I will now create the users and groups. This can take a long time...\n")
+  return actions
 
-showuser()
-# prepare pdf-output (if pdfOneDoc == yes)
+# Function: the import
+# Reads the config and the csv-file, shows the preview and creates the users. Fills the summary and
+# returns the exit code, errors which end the import are raised as FatalError.
 
-if config_pdfOneDoc == 'yes':
+def run(summary):
+  global client, journal, snapshot, output_dir, tmp_dir, today
 
-  output_filename = "userlist_" + today + ".pdf"
-  output_filepath = os.path.join( output_dir, output_filename )  
-  doc = SimpleDocTemplate(output_filepath,pagesize=A4,
-                         rightMargin=72,leftMargin=72,
-                         topMargin=72,bottomMargin=18)
-# prepare pdf-content
-Story=[]
-
-# read rows from CSV file
-with codecs.open(os.path.join(appdir, config_csvfile),mode='r', encoding='utf-8') as csvfile:
-  readCSV = csv.reader(csvfile, delimiter=config_csvDelimiter)
-  next(readCSV, None)  # skip the headers
-  for row in readCSV:
-    line = html.escape(row[0])
-    row[0] = line.translate(mapping) # convert special characters and umlauts
-    if config_GeneratePassword == 'yes':
-      if not row[2]:
-        row[2] = dynamicPW(12)
-        # The Funktion pwgenerator is outdated use dynamicPW instead
-    
-    print("Username:",html.escape(row[0]),"| Display name:",html.escape(row[1]),"| Password: ","*" * len(row[2]) + "| Email:",html.escape(row[3]),"| Groups:",html.escape(row[4]),"| Group admin for:",html.escape(row[5]),"| Quota:",html.escape(row[6]),)
-    # build the dataset for the request
-    data = [
-      ('userid', html.escape(row[0])),
-      ('displayName', html.escape(row[1])), 
-      ('password', html.escape(row[2])),
-      ('email', html.escape(row[3])),
-      ('quota', html.escape(row[6])),
-      ('language', config_language)
-    ]
-
-    # if value exists: append single groups to data array/list for CURL
-    
-    if row[4]:
-      grouplist = html.escape(row[4]).split(config_csvDelimiterGroups) # Groups in the CSV-file are split by semicolon --> load into list
-    else:
-      grouplist = []
-    # check if group exists  
-    for group in grouplist:
-     try:
-       groupresponse = requests.get(config_protocol + '://' + config_adminname + ':' + config_adminpass + '@' + 
-         config_ncUrl + config_apiUrlGroups + '?search=' + group.strip(), headers=requestheaders, verify=config_sslVerify)
-     except requests.exceptions.RequestException as e:  # handling errors
-       print(e)
-       print("The CURL request could not be performed.")
-       input("Press [ANY KEY] to confirm and end the process.")
-       sys.exit(1)
-
-     response_xmlsoup = BeautifulSoup(groupresponse.text, "html.parser")
-
-    # if group does not exists, create group
-     if not response_xmlsoup.find('element'):
-       try:
-         groupdata = {
-           'groupid':group.strip()
-         }
-         groupresponse = requests.post(config_protocol + '://' + config_adminname + ':' + config_adminpass + '@' + 
-           config_ncUrl + config_apiUrlGroups, headers=requestheaders, data=groupdata, verify=config_sslVerify)
-       except requests.exceptions.RequestException as e:  # handling errors
-         print(e)
-         print("The CURL request could not be performed.")
-         input("Press [ANY KEY] to confirm and end the process.")
-         sys.exit(1)
-       response_xmlsoup = BeautifulSoup(groupresponse.text, "html.parser")
-
-      # catch wrong config (create group)
-       if groupresponse.status_code != 200:
-        print("HTTP Status: " + str(groupresponse.status_code))
-        print("Your config.xml is wrong or your cloud is not reachable.")
-        input("Press [ANY KEY] to confirm and end the process.")
-        sys.exit(1)
-
-      # show detailed info of response (create group)
-       response_xmlsoup = BeautifulSoup(groupresponse.text, "html.parser")
-       print('Create group "' + group.strip() + '": ' + response_xmlsoup.find('status').string + ' ' + response_xmlsoup.find('statuscode').string + 
-        ' = ' + response_xmlsoup.find('message').string)
-
-     data.append(('groups[]', group.strip())) # groups is parameter NC API
-
-    # if value exists: append group admin values to data array/list for CURL
-   
-    if row[5]:
-      groupadminlist = html.escape(row[5]).split(config_csvDelimiterGroups) # Groupadmin Values in the CSV-file are split by semicolon --> load into list
-      try:
-        for groupadmin in groupadminlist: 
-          data.append(('subadmin[]', groupadmin.strip())) # subadmin is parameter NC API
-      except NameError:
-        print("groupadminlist is not defined")
+  loadconfig(args.config)
+  summary['csvfile'] = config_csvfile
+
+  print("")
+  print("###################################################################################")
+  print("# Welcome to the Nextcloud user import.                                           #")
+  print("# Please check the preview of the user import very carefully before you start     #")
+  print("# the import process.                                                             #")
+  print("###################################################################################")
+  print("")
+  if not args.yes:
+    print("")
+    print("When you are sure that your settings in the config.xml are correct,")
+    print("press [ANY KEY] to continue.")
+    input("Otherwise, press [CONTROL + C] to abort the process.")
+    print("")
+    print("They have decided to continue. A user import preview is generated.")
+    print("")
+
+  # check if user-import-csv-filme exists
+  if not os.path.isfile(os.path.join(appdir, config_csvfile)):
+    raise FatalError("ERROR!", "The csv-file (" + config_csvfile + ") you specified in you config.xml does not exist. Please save '" + config_csvfile + "' in main-directory of the script or edit your config.xml")
+
+  # check if the letter template exists
+  if not os.path.isfile(os.path.join(appdir, config_letterTemplate)):
+    raise FatalError("ERROR!", "The letter template (" + config_letterTemplate + ") you specified in you config.xml does not exist. Please save '" + config_letterTemplate + "' in main-directory of the script or edit your config.xml")
+
+  client = OCSClient(config_protocol + '://' + config_ncUrl, config_adminname, config_adminpass, config_sslVerify,
+    poolsize=config_poolsize, timeout=config_timeout, retries=config_retries, backoff=config_backoff,
+    ratelimit=config_rateLimit, concurrency=config_concurrency)
+  output_dir = args.output_dir
+
+  # adds date and time as string to variable
+  today = datetime.now().strftime('%Y-%m-%d_%H-%M-%S') 
+
+  # read and check the csv-file
+  csvhash = hashlib.sha256()
+  with timings.measure('csv-file'):
+    users = list(readusers(os.path.join(appdir, config_csvfile), csvhash))
+  summary['rows'] = len(users)
+
+  # pre-flight: load all existing users and groups once, so existing users are not created again
+  # and groups are not searched for every row
+  print("Loading existing users and groups from your cloud...")
+  with timings.measure('load existing users'):
+    loadusers()
+  with timings.measure('load existing groups'):
+    loadgroups()
+  print("")
+
+  # journal of this csv-file, see Journal
+  journal = Journal(os.path.join(output_dir, 'journal_' + csvhash.hexdigest()[:16] + '.jsonl'))
+  if args.resume:
+    journal.load()
+  elif os.path.isfile(journal.path) and not args.dry_run:
+    print("ATTENTION: The last import of this csv-file did not finish. Start the script with --resume to continue it.")
+    print("If you continue now, the import starts from the beginning.")
+    print("")
+
+  # snapshot of the last import of this csv-file into this cloud, see Snapshot
+  snapshot = Snapshot(args.snapshot or os.path.join(output_dir, 'snapshot_' +
+    hashlib.sha256((config_ncUrl + "\n" + os.path.basename(config_csvfile)).encode('utf-8')).hexdigest()[:16] + '.jsonl'))
+  snapshot.load()
+
+  # user names which are not unique after the conversion of special characters
+  checkusernames(users)
+
+  removed = removedusers(users)
+  # protection against an incomplete csv-file, which would remove most of the users
+  if len(removed) > len(snapshot.users) * config_removeLimit / 100:
+    raise FatalError("ERROR: " + str(len(removed)) + " of " + str(len(snapshot.users)) + " users of the last import are no longer in the csv-file.",
+      "More than removelimit (" + str(config_removeLimit) + " %) users would be " + config_removedUsers + "d. Please check your csv-file or change removelimit in your config.xml.")
+
+  users = withpasswords(users)
+  summary['planned'] = showuser(users, removed)
+  if args.dry_run:
+    print("\nDry run: nothing has been changed in your cloud.")
+    return 0
+
+  # set/create output-directory
+  if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+
+  # set/create temporary-directory, one per csv-file so imports can run side by side
+  # It is kept for --resume (chunks of the one pdf-file). Files of an aborted import contain passwords, so
+  # they are removed if the import starts from the beginning (also the directories of older versions).
+  tmp_dir = os.path.join('tmp', csvhash.hexdigest()[:16])
+  if not args.resume:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+  if os.path.isdir('tmp'):
+    for name in os.listdir('tmp'):
+      if re.match(r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_', name):
+        shutil.rmtree(os.path.join('tmp', name), ignore_errors=True)
+  for name in os.listdir(output_dir):
+    if name.startswith('userlist_') and name.endswith('.pdf.part'):
+      os.remove(os.path.join(output_dir, name))
+  os.makedirs(tmp_dir, exist_ok=True)
+
+  journal.open(args.resume)
+  startlog(os.path.join(output_dir, 'output.log'))
+  try:
+    return importusers(users, removed, summary)
+  finally:
+    stoplog()
+
+# Function: create the users and render the pdf-files
+# Returns the exit code like run.
+
+def importusers(users, removed, summary):
+  # load the letter template once, before the render processes are started
+  loadletter()
 
-    # perform the request
+  # start the render stage before the request threads
+  renderer = PdfRenderer(config_pdfWorkers, config_pdfChunkSize)
+
+  # create users concurrently (config_concurrency requests at the same time), but print and log
+  # the results in the order of the csv-file
+  results = collections.Counter() # rows per result, for the summary
+  summary['results'] = results
+  applied = dict(snapshot.users) # the next snapshot
+  fatalerror = None
+  with ThreadPoolExecutor(max_workers=config_concurrency) as executor:
     try:
-      response = requests.post(config_protocol + '://' + config_adminname + ':' + config_adminpass + '@' + 
-        config_ncUrl + config_apiUrl, headers=requestheaders, data=data, verify=config_sslVerify)
-    except requests.exceptions.RequestException as e:  # handling errors
-      print(e)
-      print("The CURL request could not be performed.")
-      input("Press [ANY KEY] to confirm and end the process.")
-      sys.exit(1)
-
-    # catch wrong config
-    if response.status_code != 200:
-      print("HTTP Status: " + str(response.status_code))
-      print("Your config.xml is wrong or your cloud is not reachable.")
-      input("Press [ANY KEY] to confirm and end the process.")
-      sys.exit(1)
-
-    # show detailed info of response
-    response_xmlsoup = BeautifulSoup(response.text, "html.parser")
-    print(response_xmlsoup.find('status').string + ' ' + response_xmlsoup.find('statuscode').string + 
-      ' = ' + response_xmlsoup.find('message').string)
-
-    # append detailed response to logfile in output-folder
-    logfile = codecs.open(os.path.join(output_dir,'output.log'),mode='a', encoding='utf-8')
-    logfile.write("\nUSER: " + html.escape(row[0]) + "\nTIME: " + time.strftime("%d.%m.%Y %H:%M:%S",time.localtime(time.time())) + 
-      "\nRESPONSE: " + response_xmlsoup.find('status').string + ' ' + response_xmlsoup.find('statuscode').string + 
-      ' = ' + response_xmlsoup.find('message').string + "\n")
-    logfile.close()
-
-    # A QR code and a PDF file are only generated if the user has been successfully created.
-
-    if response_xmlsoup.find('statuscode').string == "100":
-      # generate qr-code
-      qr.add_data("nc://login/user:" + html.escape(row[0]) + "&password:" + html.escape(row[2]) + "&server:https://" + config_ncUrl)
-      img = qr.make_image(fill_color="black", back_color="white")
-      img.save(os.path.join( tmp_dir, html.escape(row[0]) + ".jpg" ))
-      qr.clear()
-
-      # prepare pdf-output (if pdfOneDoc == no)
-      if config_pdfOneDoc == 'no':
-       
-        output_filename = html.escape(row[0]) + "_" + today + ".pdf"
- 
-        output_filepath = os.path.join( output_dir, output_filename )
-        
-        doc = SimpleDocTemplate(output_filepath,pagesize=A4,
-                                rightMargin=72,leftMargin=72,
-                                topMargin=52,bottomMargin=18)       
-
-      
-      nclogo = "assets/Logo_WLLV.jpeg" # nextcloud-logo (if in normal mode)
-      ncuserlogin = html.escape(row[0]) # loginname
-      ncusername = html.escape(row[1]) # username
-      ncpassword = html.escape(row[2]) # password
-      nclink = config_protocol + "://" + config_ncUrl # adds nextcloud-url
-        # adds nextcloud-logo to pdf-file 
-      im = Image(nclogo, 150, 106)
-      Story.append(im)
-      Story.append(Spacer(1, 12))
-
-
-      styles=getSampleStyleSheet()
-      styles.add(ParagraphStyle(name='Justify', alignment=TA_JUSTIFY))
-      # adds text to pdf-file
-
-      ptext = '<font size=14>Hallo %s,</font>' % ncusername
-      Story.append(Paragraph(ptext, styles["Justify"]))
-      Story.append(Spacer(1, 12))
-
-      ptext = '<font size=14>Für Sie wurde ein Nextcloud angelegt.</font>'
-      Story.append(Paragraph(ptext, styles["Justify"]))
-      Story.append(Spacer(1, 12))    
-
-
-      ptext = '<font size=14>Sie können sich mit folgenden Nutzerdaten einloggen:</font>'
-      Story.append(Paragraph(ptext, styles["Normal"]))
-      Story.append(Spacer(1, 36))
-
-      ptext = '<font size=14>Link zu Ihrer Nextcloud-Instanz:</font>'
-      Story.append(Paragraph(ptext, styles["Normal"]))
-      Story.append(Spacer(1, 12))    
-
-      ptext = '<font size=14>%s</font>' % nclink
-      Story.append(Paragraph(ptext, styles["Normal"]))
-      Story.append(Spacer(1, 24))
-
-      ptext = '<font size=14>Nutzername:</font>'
-      Story.append(Paragraph(ptext, styles["Normal"]))
-      Story.append(Spacer(1, 12))    
-
-      ptext = '<font size=14>%s</font>' % ncuserlogin
-      Story.append(Paragraph(ptext, styles["Normal"]))
-      Story.append(Spacer(1, 24))
-
-      ptext = '<font size=14>Passwort:</font>'
-      Story.append(Paragraph(ptext, styles["Normal"]))
-      Story.append(Spacer(1, 12))    
-
-      ptext = '<font size=14>%s</font>' % ncpassword
-      Story.append(Paragraph(ptext, styles["Normal"]))
-      Story.append(Spacer(1, 24))
-      
-
-      if config_pdfOneDoc == 'no':
-        # create pdf-file (single documents)
-        doc.build(Story)	  
-      else:
-        Story.append(PageBreak())
-        # create pdf-file (one document)
-if config_pdfOneDoc == 'yes':
-  doc.build(Story)
-
-# Clean up tmp-folder
-filelist = [ f for f in os.listdir(tmp_dir) ]
-for f in filelist:
-    os.remove(os.path.join(tmp_dir, f))
-
-
-print("")
-print("###################################################################################")
-print("# Control the status codes of the user creation above or in the output.log.       #")
-print("# You should as well see the users in your Nextcloud now.                         #")
-print("#                                                                                 #")
-print("# A PDF-File with login-info and qr-code has been generated for every user.       #")
-print("#                                                                                 #")
-print("# For security reasons: please delete your credentials from config.xml            #")
-print("###################################################################################")
-print("")
-input("Press [ANY KEY] to confirm and end the process.")
+      planned = [(user, jobaction(user)) for user in users]
+      # create the missing groups once, before the users are sent
+      try:
+        groupstage(planned, executor, results)
+      except FatalError as e:
+        # no user is sent, the import stops after the render stage and the cleanup below
+        fatalerror = e
+        abort.set()
+        planned = []
+
+      # new users: one request per row; existing users: every change is queued on its own
+      jobs = []
+      for user, action in planned:
+        futures = []
+        if action == 'create':
+          # group-ok: the group stage has created all groups of the user
+          state = 'group-ok' if knowngroups.issuperset(user.groups + user.subadmin) else 'pending'
+          if user.generated:
+            journal.record(user, state, password=user.password)
+          else:
+            journal.record(user, state)
+          futures.append(executor.submit(createuser, user))
+        elif action in ('update', 'groups'):
+          futures = [executor.submit(sendchange, change) for change in updatechanges(user, action)]
+        elif action == 'sync':
+          futures = [executor.submit(sendchange, change) for change in syncchanges(user)]
+        jobs.append((user, action, futures))
+
+      for user, action, futures in jobs:
+        if action == 'unchanged': # unchanged since the last import (--sync), nothing to do
+          applied[user.userid.lower()] = snapshotentry(user)
+          results['unchanged'] += 1
+          continue
+
+        if action == 'done': # finished in the last run
+          print("Username:",user.userid,"| already imported in the last run")
+          logrow(user, 'done')
+          previous = journal.state(user.number).get('state')
+          if previous in ('pdf-done', 'updated', 'synced'): # applied in the last run
+            applied[user.userid.lower()] = snapshotentry(user, created=previous == 'pdf-done')
+          results['done'] += 1
+          continue
+
+        if action == 'pdf': # created in the last run, but the pdf-file is missing
+          print("Username:",user.userid,"| created in the last run, generating the pdf-file")
+          journal.record(user, 'created')
+          logrow(user, 'created', resumed=True)
+          applied[user.userid.lower()] = snapshotentry(user, created=True)
+          renderer.add(user)
+          results['created'] += 1
+          continue
+
+        if action == 'skip': # existing user, nothing to do
+          print("Username:",user.userid,"| already exists in your cloud, skipped")
+          logrow(user, 'skipped', response="user already exists")
+          journal.record(user, 'skipped')
+          results['skipped'] += 1 # not applied: the snapshot keeps the entry of the last import, if any
+          continue
+
+        try:
+          result = futures[0].result() if action == 'create' else changesresult(futures)
+        except FatalError as e:
+          # keep reporting the rows that were already sent, stop after that
+          if fatalerror is None:
+            fatalerror = e
+          continue
+        if result is None: # row was skipped because of a fatal error in another row
+          continue
+        messages, ocsresult, ok = result.messages, result.ocsresult, result.ok
+        timing = dict(latency_ms=round(result.latency * 1000), retries=result.retries)
+
+        print("Username:",user.userid,"| Display name:",user.displayname,"| Password: ","*" * len(user.password) + "| Email:",user.email,"| Groups:",config_csvDelimiterGroups.join(user.groups),"| Group admin for:",config_csvDelimiterGroups.join(user.subadmin),"| Quota:",user.quota,)
+        for message in messages:
+          print(message)
+
+        if action in ('update', 'groups', 'sync'):
+          # append the changes to the log
+          state = ('synced' if action == 'sync' else 'updated') if ok else 'failed'
+          logrow(user, state, messages=messages, **timing)
+          journal.record(user, state)
+          if ok:
+            applied[user.userid.lower()] = snapshotentry(user)
+          results[state] += 1
+          continue
+
+        # show detailed info of response
+        print(ocsstatus(ocsresult))
+
+        # append detailed response to the log
+        logrow(user, 'created' if ok else 'failed', response=ocsstatus(ocsresult), messages=messages, **timing)
+
+        # A QR code and a PDF file are only generated if the user has been successfully created.
+
+        if ok:
+          journal.record(user, 'created')
+          applied[user.userid.lower()] = snapshotentry(user, created=True)
+          renderer.add(user)
+          results['created'] += 1
+        else:
+          journal.record(user, 'failed', response=ocsstatus(ocsresult))
+          results['failed'] += 1
+
+      # users who are no longer in the csv-file (--sync)
+      removals = [(user, executor.submit(removeuser, user)) for user in removed]
+      for user, future in removals:
+        try:
+          result = future.result()
+        except FatalError as e:
+          if fatalerror is None:
+            fatalerror = e
+          continue
+        if result is None:
+          continue
+        state = (config_removedUsers + 'd') if result.ok else 'failed'
+        print("Username:",user.userid,"| no longer in the csv-file,",config_removedUsers + ":",ocsstatus(result.ocsresult))
+        logrow(user, state, response=ocsstatus(result.ocsresult), latency_ms=round(result.latency * 1000), retries=result.retries)
+        if result.ok and config_removedUsers == 'delete':
+          del applied[user.userid.lower()]
+        elif result.ok:
+          applied[user.userid.lower()] = dict(applied[user.userid.lower()], disabled=True)
+        results[state] += 1
+    except KeyboardInterrupt:
+      abort.set() # don't send the remaining rows, the journal is kept for --resume
+      raise
+
+  # wait for the render stage
+  print("")
+  print("Waiting for the pdf-files...")
+  pdferrors = renderer.finish()
+  summary['pdferrors'] = pdferrors
+  for line in pdferrors:
+    print(line)
+
+  client.close()
+  print("")
+  print(client.stats())
+
+  # stop after the results of all sent rows have been reported, if the config is wrong or the cloud is not reachable
+  if fatalerror is None and pdferrors:
+    fatalerror = FatalError("Not all pdf-files could be created.")
+  if fatalerror is not None:
+    journal.close(finished=False)
+    raise FatalError(*fatalerror.args, "Run the import again with --resume to continue where it stopped.")
+
+  # users of the last import who have been deleted in the cloud are not in the snapshot anymore
+  csvusers = {user.userid.lower() for user in users}
+  snapshot.save({key: entry for key, entry in applied.items() if key in csvusers or key in knownusers})
+
+  # the journal contains the generated passwords, it is only kept as long as the import is not finished
+  journal.close(finished=True)
+  shutil.rmtree(tmp_dir, ignore_errors=True)
+
+  print("")
+  print("###################################################################################")
+  print("# Control the status codes of the user creation above or in the output.log.       #")
+  print("# You should as well see the users in your Nextcloud now.                         #")
+  print("#                                                                                 #")
+  print("# A PDF-File with login-info and qr-code has been generated for every user.       #")
+  print("#                                                                                 #")
+  print("# For security reasons: please delete your credentials from config.xml            #")
+  print("###################################################################################")
+  print("")
+  return 3 if results['failed'] else 0
+
+# Function: write the summary of the import as json (--summary), for scripts which run the import
+def writesummary(summary, path):
+  if path == '-':
+    print(json.dumps(summary, indent=2))
+  else:
+    with codecs.open(path, mode='w', encoding='utf-8') as summaryfile:
+      json.dump(summary, summaryfile, indent=2)
+
+# Entry point: returns the exit code (see the epilog of parser)
+def main(argv=None):
+  global args
+  args = parser.parse_args(argv)
+
+  print("")
+  print("")
+  print("###################################################################################")
+  print("# NEXTCLOUD-USER-IMPORTER                                                         #")
+  print("###################################################################################")
+  print("")
+  print("Copyright (C) 2019-2020 Torsten Markmann (t-markmann),")
+  print("Contributors: Johannes Schirge (Shen), Nicolas Stuhlfauth (nicostuhlfauth), Daniel Bruns")
+  print("This program comes with ABSOLUTELY NO WARRANTY")
+  print("This is free software, and you are welcome to redistribute it under certain conditions.")
+  print("For details look into LICENSE file (GNU GPLv3).")
+  print("")
+  started = time.monotonic()
+  summary = {'csvfile': None, 'dryrun': args.dry_run, 'rows': 0, 'planned': {}, 'results': {}, 'pdferrors': [], 'error': None}
+  try:
+    code = run(summary)
+  except FatalError as e:
+    for line in e.args:
+      print(line)
+    summary['error'] = " ".join(e.args)
+    code = 1
+  except KeyboardInterrupt:
+    print("")
+    print("Aborted. Run the import again with --resume to continue where it stopped.")
+    summary['error'] = "aborted"
+    code = 130
+
+  if client is not None:
+    summary.update(requests=client.requests, retries=client.retried, connections=client.connections)
+  summary['timings'] = timings.report()
+  if summary['timings']:
+    print("")
+    print("Timings of the import:")
+    print(tabulate(summary['timings'], headers="keys"))
+  summary['seconds'] = round(time.monotonic() - started, 3)
+  summary['exitcode'] = code
+  if args.summary:
+    writesummary(summary, args.summary)
+  if code != 130:
+    pause("Press [ANY KEY] to confirm and end the process.")
+  return code
+
+if __name__ == '__main__':
+  multiprocessing.freeze_support() # render processes of the Windows executable
+  sys.exit(main())